@@ -1,18 +1,32 @@
-import openai
 import streamlit as st
-from openai import AzureOpenAI
 import os
-import numpy as np
-import json
-from datetime import datetime
+import sys
 import pandas as pd
-from azure.cosmos import CosmosClient, exceptions, PartitionKey
 from dotenv import load_dotenv
 import time
 
+# Modules shared with the data loader live in src/common
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from common.clients import create_cosmos_client, create_openai_client, embedding_model as client_embedding_model
+from common.embedding_cache import cache_from_env
+from common.embedding_decode import ENCODING_FORMAT, decode_embeddings
+from common.metrics import metrics_from_env
+from common.provisioning import provision, transform_policy
+from common.result_cache import result_cache_from_env, result_key
+from common.queries import (DEFAULT_TOP_K, describe_query, full_text_ranking_query, full_text_search_query,
+                            hybrid_ranking_query, query_keywords, vector_search_query)
+from common.vector_transform import transform_from_env
+from common.search_service import DEFAULT_CANDIDATE_DEPTH, INDEX_CONTAINERS, RRF_K, SearchService
+
+# Records shown per page of the results table; searches fetch all their records in one round trip
+RESULT_PAGE_SIZE = 10
+
 # Load environment variables
 load_dotenv()
 
+embedding_model = client_embedding_model()
+
 st.set_page_config(page_title="Ignite 2024 Demo", layout="wide", initial_sidebar_state="expanded")
 # UI text strings
 page_title = "Azure Cosmos DB - Search Demo"
@@ -25,112 +39,42 @@ full_text_ranking_label = "Full text ranking"
 full_text_search_label = "Full text search"
 venue_list_header = "Research papers"
 hybrid_search_label = "Hybrid search"
-
-# Initialize global variables for Cosmos DB client, database, and containers
-if "cosmos_client" not in st.session_state:
-    endpoint = os.getenv("AZURE_COSMOSDB_ENDPOINT")
-    key = os.getenv("AZURE_COSMOSDB_KEY")
-    st.session_state.cosmos_client = CosmosClient(endpoint, credential=key)
-    database_name = 'ignite2024demo'  # Replace with your database name
-    st.session_state.cosmos_database = st.session_state.cosmos_client.create_database_if_not_exists(database_name)
-
-    # Define the vector property and dimensions
-    cosmos_vector_property = "embedding"
-    cosmos_full_text_property = "text"
-    openai_embeddings_dimensions = 1536
-
-    # policies and indexes
-    full_text_policy = {
-        "defaultLanguage": "en-US",
-        "fullTextPaths": [
-            {
-                "path": "/" + cosmos_full_text_property,
-                "language": "en-US",
-            }
-        ]
-    }
-    vector_embedding_policy = {
-        "vectorEmbeddings": [
-            {
-                "path": "/" + cosmos_vector_property,
-                "dataType": "float32",
-                "distanceFunction": "cosine",
-                "dimensions": openai_embeddings_dimensions
-            },
-        ]
-    }
-    qflat_indexing_policy = {
-        "includedPaths": [
-            {"path": "/*"}
-        ],
-        "excludedPaths": [
-            {"path": "/\"_etag\"/?"}
-        ],
-        "vectorIndexes": [
-            {
-                "path": "/" + cosmos_vector_property,
-                "type": "quantizedFlat",
-            }
-        ],
-        "fullTextIndexes": [
-            {
-                "path": "/" + cosmos_full_text_property
-            }
-        ]
-    }
-
-    diskann_indexing_policy = {
-        "includedPaths": [
-            {"path": "/*"}
-        ],
-        "excludedPaths": [
-            {"path": "/\"_etag\"/?"}
-        ],
-        "vectorIndexes": [
-            {
-                "path": "/" + cosmos_vector_property,
-                "type": "diskANN",
-            }
-        ],
-        "fullTextIndexes": [
-            {
-                "path": "/" + cosmos_full_text_property
-            }
-        ]
-    }
-
-    # Create listings_search container without any index
-    container_name = 'search'
-    st.session_state.cosmos_container = st.session_state.cosmos_database.create_container_if_not_exists(
-        id=container_name,
-        partition_key=PartitionKey(path="/id"),
-        full_text_policy=full_text_policy,
-        vector_embedding_policy=vector_embedding_policy,
-        offer_throughput=10000
-    )
-
-
-    # Create listings_search_qflat container with QFLAT vector index
-    container_name_qflat = 'search_qflat'
-    st.session_state.cosmos_container_qflat = st.session_state.cosmos_database.create_container_if_not_exists(
-        id=container_name_qflat,
-        partition_key=PartitionKey(path="/id"),
-        full_text_policy=full_text_policy,
-        vector_embedding_policy=vector_embedding_policy,
-        indexing_policy=qflat_indexing_policy,
-        offer_throughput=10000
-    )
-
-    # Create listings_search_diskann container with DiskANN vector index
-    container_name_diskann = 'search_diskann'
-    st.session_state.cosmos_container_diskann = st.session_state.cosmos_database.create_container_if_not_exists(
-        id=container_name_diskann,
-        partition_key=PartitionKey(path="/id"),
-        full_text_policy=full_text_policy,
-        vector_embedding_policy=vector_embedding_policy,
-        indexing_policy=diskann_indexing_policy,
-        offer_throughput=10000
-    )
+client_hybrid_search_label = "Hybrid search (client-side RRF)"
+compare_indexes_option = "Compare all indexes"
+
+# Clients are created once per process and shared by every session; the database and
+# containers are provisioned the first time any session needs them, not on every new session
+database_name = 'ignite2024demo'  # Replace with your database name
+
+# Query vectors are reduced and encoded like the documents when the loader compacted them
+@st.cache_resource
+def get_vector_transform():
+    return transform_from_env()
+
+@st.cache_resource
+def get_cosmos_database():
+    return provision(create_cosmos_client(), database_name, **transform_policy(get_vector_transform()))
+
+@st.cache_resource
+def get_embedding_client():
+    return create_openai_client()
+
+# Latency of each stage of a search, kept per process and served on METRICS_PORT when it is set
+@st.cache_resource
+def get_metrics():
+    return metrics_from_env()
+
+@st.cache_resource
+def get_search_service():
+    return SearchService(get_cosmos_database(), metrics=get_metrics())
+
+# Time from the start of a new session until its clients are ready, shown with its first query
+if "session_started" not in st.session_state:
+    st.session_state.session_started = time.perf_counter()
+    get_search_service()
+    get_embedding_client()
+    st.session_state.session_ready_time = time.perf_counter() - st.session_state.session_started
+    print(f"Session ready in {st.session_state.session_ready_time:.4f} seconds")
 
 # Initialize session state variables
 if "embedding_gen_time" not in st.session_state:
@@ -143,6 +87,8 @@ if "executed_query" not in st.session_state:
     st.session_state.executed_query = ""
 if "server_query_time" not in st.session_state:
     st.session_state.server_query_time = ""
+if "pages_fetched" not in st.session_state:
+    st.session_state.pages_fetched = ""
 
 # Function to log times
 def log_time(start):
@@ -150,176 +96,181 @@ def log_time(start):
     elapsed_time = end - start
     return f"{elapsed_time:.4f} seconds"
 
-# Initialize the embedding client only once
-if "embedding_client" not in st.session_state:
-    st.session_state.embedding_client = AzureOpenAI(
-        api_key=os.getenv("AZURE_OPENAI_APIKEY"),
-        api_version="2023-05-15",
-        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT")
-    )
+# One embedding cache per process, shared by every session and backed by the same file as the data loader
+@st.cache_resource
+def get_embedding_cache():
+    return cache_from_env()
+
+# Recent results, shared by every session and invalidated when the data loader writes to a container
+@st.cache_resource
+def get_result_cache():
+    return result_cache_from_env(database_name)
 
 # Handler functions
 def embedding_query(text_input):
     print("text_input", text_input)
     start_time = time.perf_counter()
-    response = st.session_state.embedding_client.embeddings.create(
-        input=text_input,
-        model="text-embedding-ada-002"  # Use the appropriate model
-    )
-
-    json_response = response.model_dump_json(indent=2)
-    parsed_response = json.loads(json_response)
-    embedding = parsed_response['data'][0]['embedding']
+    embedding_cache = get_embedding_cache()
+    cached_embedding = embedding_cache.get(embedding_model, text_input)
+    if cached_embedding is not None:
+        embedding = cached_embedding.tolist()
+    else:
+        response = get_embedding_client().embeddings.create(
+            input=text_input,
+            model=embedding_model,  # Use the appropriate model
+            encoding_format=ENCODING_FORMAT
+        )
+
+        # Read straight from the response's float32 bytes rather than round-tripping it through JSON
+        vector = decode_embeddings(response)[0]
+        embedding_cache.put(embedding_model, text_input, vector)
+        embedding = vector.tolist()
+    get_metrics().observe("embedding_seconds", time.perf_counter() - start_time,
+                          source="cache" if cached_embedding is not None else "service")
     st.session_state.embedding_gen_time = log_time(start_time)
     print(f"Embedding generation time: {st.session_state.embedding_gen_time}")
+    if get_vector_transform() is not None:
+        embedding = get_vector_transform().encode(embedding)
     return embedding
 
+def selected_indexes(indices):
+    # One index, or all three at once when comparing; either way the containers are queried concurrently
+    return list(INDEX_CONTAINERS) if indices == compare_indexes_option else [indices]
+
+def queue_search(handler, *args):
+    # Button callbacks only queue the search; it runs in the script run that follows, where its
+    # pages can be drawn as they arrive
+    st.session_state.pending_search = (handler, args)
+
+def run_query(indexes, query, parameters, top_k):
+    # Pages are as large as the query's TOP, so a search is one round trip unless the service splits
+    # a large response. A single index redraws the records fetched so far as pages arrive; several
+    # indexes are queried concurrently and shown once all of them have finished
+    if len(indexes) > 1:
+        return get_search_service().search(query, parameters, indexes, page_size=top_k)
+    progress = st.empty()
+    for result in get_search_service().search_pages(indexes[0], query, parameters, page_size=top_k):
+        with progress.container():
+            st.write(f"Fetched {len(result.items)} records in {result.pages} pages, {result.request_charge:.2f} RU so far")
+            st.table(pd.DataFrame(result.items))
+    progress.empty()
+    return [result]
+
+def cached_search(indices, mode, text, top_k, options, search):
+    # Indexes with a fresh cached result for the same search are served from the cache; only the
+    # rest are queried, through search(indexes), which embeds the text only when it has to query
+    result_cache = get_result_cache()
+    indexes = selected_indexes(indices)
+    keys = {index: result_key(mode, INDEX_CONTAINERS[index], text, top_k, options) for index in indexes}
+    results = {index: result_cache.get(keys[index]) for index in indexes}
+    missing = [index for index in indexes if results[index] is None]
+    if missing:
+        versions = {index: result_cache.version(keys[index]) for index in missing}
+        for result in search(missing):
+            result_cache.put(keys[result.index], result, versions[result.index])
+            results[result.index] = result
+    else:
+        st.session_state.executed_query = "Served from the result cache; no query was sent."
+        st.session_state.embedding_gen_time = "not needed"
+    show_results([results[index] for index in indexes])
+
+def ru_readout(result):
+    if result.cached:
+        return f"0.00 (served from cache, {result.request_charge:.2f} RU saved)"
+    return f"{result.request_charge:.2f}"
+
+def show_results(results):
+    for result in results:
+        if result.error is not None:
+            st.error(f"An error occurred on {result.index}: {result.error}")
+
+    st.session_state.index_comparison = results if len(results) > 1 else None
+    if "time_to_first_query" not in st.session_state:
+        st.session_state.time_to_first_query = (
+            f"{st.session_state.session_ready_time:.4f} seconds to ready the session, "
+            f"{max(result.latency for result in results):.4f} seconds for the first query")
+    result = results[0]
+    st.session_state.hybrid_arms = result.arms
+    if result.error is None:
+        with get_metrics().span("dataframe_build"):
+            st.session_state.suggested_listings = pd.DataFrame(result.items)
+        # A new search starts at the first page of the results table
+        st.session_state.pop("results_page", None)
+        st.session_state.query_time = f"{result.latency:.4f} seconds" + (" (when first run)" if result.cached else "")
+        st.session_state.ru_consumed = ru_readout(result)
+        st.session_state.pages_fetched = result.pages
+        st.session_state.server_query_time = f"{result.server_time:.4f} seconds" + (" (when first run)" if result.cached else "")
+
 def handler_vector_search(indices, ask):
-    emb = embedding_query(ask)
-    num_results = 10
-
-    # Query strings
-    vector_search_query = f'''
-    SELECT TOP {num_results} l.id, l.title, l.text, VectorDistance(l.embedding, {emb}) as SimilarityScore
-    FROM l
-    ORDER BY VectorDistance(l.embedding,{emb})
-    '''
-
-    obfuscated_query = vector_search_query.replace(str(emb), "REDACTED")
-
-    container = {
-        'No Index': st.session_state.cosmos_container,
-        'QFLAT & Full Text Search Index': st.session_state.cosmos_container_qflat,
-        'DiskANN & Full Text Search Index': st.session_state.cosmos_container_diskann
-    }.get(indices)
-
-    try:
-        start_time = time.perf_counter()  # Capture start time
-        st.session_state.executed_query = obfuscated_query
-        results = container.query_items(vector_search_query, enable_cross_partition_query=True, populate_query_metrics=True)
-        results_list = list(results)
-        elapsed_time = log_time(start_time)
-        st.session_state.suggested_listings = pd.DataFrame(results_list)
-        st.session_state.query_time = elapsed_time
-        st.session_state.ru_consumed = container.client_connection.last_response_headers['x-ms-request-charge']
-        total_execution_time = parse_server_query_time(container.client_connection.last_response_headers['x-ms-documentdb-query-metrics'])
-        st.session_state.server_query_time = total_execution_time
-    except exceptions.CosmosHttpResponseError as e:
-        st.error(f"An error occurred: {e}")
+    num_results = st.session_state.num_results
+
+    def search(indexes):
+        emb = embedding_query(ask)
+        # The vector is sent as a parameter rather than inlined into the query text
+        query, parameters = vector_search_query(emb, num_results)
+        st.session_state.executed_query = describe_query(query, parameters)
+        return run_query(indexes, query, parameters, num_results)
+
+    cached_search(indices, "vector", ask, num_results, {}, search)
 
 def handler_text_search(indices, text, search_type):
-    num_results = 10
-
-    # Tokenize text into individual words
-    keywords = text.split()  # Split the text into words
-    formatted_keywords = ', '.join(f'"{keyword}"' for keyword in keywords)
-    print(formatted_keywords)# Format keywords for query
-
-    # Construct the query string with tokenized keywords
-    if search_type == "all keywords":
-        full_text_search_query = f'''
-        SELECT TOP {num_results} l.id, l.title, l.text
-        FROM l
-        WHERE FullTextContainsAll(l.text, {formatted_keywords})
-        '''
-    else:
-        full_text_search_query = f'''
-        SELECT TOP {num_results} l.id, l.title, l.text
-        FROM l
-        WHERE FullTextContainsAny(l.text, {formatted_keywords})
-        '''
-
-    container = {
-        'No Index': st.session_state.cosmos_container,
-        'QFLAT & Full Text Search Index': st.session_state.cosmos_container_qflat,
-        'DiskANN & Full Text Search Index': st.session_state.cosmos_container_diskann
-    }.get(indices)
-
-    try:
-        start_time = time.perf_counter()  # Capture start time
-        st.session_state.executed_query = full_text_search_query
-        results = container.query_items(full_text_search_query, enable_cross_partition_query=True, populate_query_metrics=True)
-        results_list = list(results)
-        elapsed_time = log_time(start_time)
-        st.session_state.suggested_listings = pd.DataFrame(results_list)
-        st.session_state.query_time = elapsed_time
-        st.session_state.ru_consumed = container.client_connection.last_response_headers['x-ms-request-charge']
-        total_execution_time = parse_server_query_time(container.client_connection.last_response_headers['x-ms-documentdb-query-metrics'])
-        st.session_state.server_query_time = total_execution_time
-    except exceptions.CosmosHttpResponseError as e:
-        st.error(f"An error occurred: {e}")
+    num_results = st.session_state.num_results
+
+    def search(indexes):
+        # Keywords are passed as parameters, so they need no quoting or escaping
+        keywords = query_keywords(text)
+        query, parameters = full_text_search_query(keywords, num_results, match_all=search_type == "all keywords")
+        st.session_state.executed_query = describe_query(query, parameters)
+        return run_query(indexes, query, parameters, num_results)
+
+    cached_search(indices, "full text search", text, num_results, {"search_type": search_type}, search)
 
 def handler_text_ranking(indices, text):
-    num_results = 10
-
-    # Tokenize text into individual words
-    keywords = text.split()  # Split the text into words
-    formatted_keywords = ', '.join(f'"{keyword}"' for keyword in keywords)  # Format keywords for query
-
-    # Construct the query string with tokenized keywords
-
-    full_text_ranking_query = f'''
-    SELECT TOP {num_results} l.id, l.title, l.text
-    FROM l
-    ORDER BY RANK FullTextScore(l.text, [{formatted_keywords}])
-    '''
-
-    container = {
-        'No Index': st.session_state.cosmos_container,
-        'QFLAT & Full Text Search Index': st.session_state.cosmos_container_qflat,
-        'DiskANN & Full Text Search Index': st.session_state.cosmos_container_diskann
-    }.get(indices)
-
-    try:
-        start_time = time.perf_counter()  # Capture start time
-        st.session_state.executed_query = full_text_ranking_query
-        results = container.query_items(full_text_ranking_query, enable_cross_partition_query=True,populate_query_metrics=True)
-        results_list = list(results)
-        elapsed_time = log_time(start_time)
-        st.session_state.suggested_listings = pd.DataFrame(results_list)
-        st.session_state.query_time = elapsed_time
-        st.session_state.ru_consumed = container.client_connection.last_response_headers['x-ms-request-charge']
-        total_execution_time = parse_server_query_time(container.client_connection.last_response_headers['x-ms-documentdb-query-metrics'])
-        st.session_state.server_query_time = total_execution_time
-    except exceptions.CosmosHttpResponseError as e:
-        st.error(f"An error occurred: {e}")
+    num_results = st.session_state.num_results
+
+    def search(indexes):
+        keywords = query_keywords(text)
+        query, parameters = full_text_ranking_query(keywords, num_results)
+        st.session_state.executed_query = describe_query(query, parameters)
+        return run_query(indexes, query, parameters, num_results)
+
+    cached_search(indices, "full text ranking", text, num_results, {}, search)
 
 def handler_hybrid_ranking(indices, text):
-    num_results = 10
-    emb = embedding_query(text)
-    # Tokenize text into individual words
-    keywords = text.split()  # Split the text into words
-    formatted_keywords = ', '.join(f'"{keyword}"' for keyword in keywords)  # Format keywords for query
-
-    # Construct the query string with tokenized keywords
-
-    full_hybrid_ranking_query = f'''
-    SELECT TOP {num_results} l.id, l.title, l.text
-    FROM l
-    ORDER BY RANK RRF(FullTextScore(l.text,[{formatted_keywords}]),VectorDistance(l.embedding, {emb}))
-    '''
-
-    obfuscated_query = full_hybrid_ranking_query.replace(str(emb), "REDACTED")
-
-    container = {
-        'No Index': st.session_state.cosmos_container,
-        'QFLAT & Full Text Search Index': st.session_state.cosmos_container_qflat,
-        'DiskANN & Full Text Search Index': st.session_state.cosmos_container_diskann
-    }.get(indices)
-
-    try:
-        start_time = time.perf_counter()  # Capture start time
-        st.session_state.executed_query = obfuscated_query
-        results = container.query_items(full_hybrid_ranking_query, enable_cross_partition_query=True,populate_query_metrics=True)
-        results_list = list(results)
-        elapsed_time = log_time(start_time)
-        st.session_state.suggested_listings = pd.DataFrame(results_list)
-        st.session_state.query_time = elapsed_time
-        st.session_state.ru_consumed = container.client_connection.last_response_headers['x-ms-request-charge']
-        total_execution_time = parse_server_query_time(container.client_connection.last_response_headers['x-ms-documentdb-query-metrics'])
-        st.session_state.server_query_time = total_execution_time
-    except exceptions.CosmosHttpResponseError as e:
-        st.error(f"An error occurred: {e}")
+    num_results = st.session_state.num_results
+
+    def search(indexes):
+        emb = embedding_query(text)
+        keywords = query_keywords(text)
+        query, parameters = hybrid_ranking_query(keywords, emb, num_results)
+        st.session_state.executed_query = describe_query(query, parameters)
+        return run_query(indexes, query, parameters, num_results)
+
+    cached_search(indices, "hybrid ranking", text, num_results, {}, search)
+
+def handler_client_hybrid_ranking(indices, text):
+    num_results = st.session_state.num_results
+    options = dict(
+        vector_depth=st.session_state.hybrid_vector_depth,
+        text_depth=st.session_state.hybrid_text_depth,
+        vector_weight=st.session_state.hybrid_vector_weight,
+        text_weight=st.session_state.hybrid_text_weight,
+        rrf_k=st.session_state.hybrid_rrf_k,
+    )
+
+    def search(indexes):
+        emb = embedding_query(text)
+        keywords = query_keywords(text)
+        # Both arms run concurrently and are fused here, so depths and weights can be tuned per workload
+        vector_query, vector_parameters = vector_search_query(emb, options["vector_depth"])
+        text_query, text_parameters = full_text_ranking_query(keywords, options["text_depth"])
+        st.session_state.executed_query = (
+            describe_query(vector_query, vector_parameters) + "\n\n" + describe_query(text_query, text_parameters)
+            + f"\n\n-- fused client-side: weighted RRF, k={options['rrf_k']}, "
+              f"weights vector={options['vector_weight']} text={options['text_weight']}")
+        return get_search_service().hybrid_search(emb, keywords, indexes, top_k=num_results, **options)
+
+    cached_search(indices, "client hybrid ranking", text, num_results, options, search)
 
 # UI elements
 def render_cta_link(url, label, font_awesome_icon):
@@ -329,38 +280,41 @@ def render_cta_link(url, label, font_awesome_icon):
     button_code = f'''<a href="{url}" target=_blank><i class="fa {font_awesome_icon}"></i> {label}</a>'''
     return st.markdown(button_code, unsafe_allow_html=True)
 
-def parse_server_query_time(query_metrics):
-    metrics_parts = query_metrics.split(";")
-    total_execution_time_ms = next(
-        (part.split("=")[1] for part in metrics_parts if "totalExecutionTimeInMs" in part), "0"
-    )
-    total_execution_time_s = float(total_execution_time_ms) / 1000
-    return f"{total_execution_time_s:.4f} seconds"
-
 def render_search():
     search_disabled = True
     with st.sidebar:
-        st.selectbox(label="Index", options=['No Index', 'QFLAT & Full Text Search Index', 'DiskANN & Full Text Search Index'], index=0, key="index_selection")
+        st.selectbox(label="Index", options=list(INDEX_CONTAINERS) + [compare_indexes_option], index=0, key="index_selection")
         st.text_input(label=semantic_search_header, placeholder=semantic_search_placeholder, key="user_query")
 
         if "user_query" in st.session_state and st.session_state.user_query != "":
             search_disabled = False
 
+        st.number_input("Number of results", 1, 1000, DEFAULT_TOP_K, key="num_results")
+
         st.button(label=vector_search_label, key="location_search", disabled=search_disabled,
-                  on_click=handler_vector_search, args=(st.session_state.index_selection, st.session_state.user_query))
+                  on_click=queue_search, args=(handler_vector_search, st.session_state.index_selection, st.session_state.user_query))
 
         # Button for Full Text Ranking search using handler_text_ranking
         st.button(label=full_text_ranking_label, key="full_text_ranking", disabled=search_disabled,
-                  on_click=handler_text_ranking, args=(st.session_state.index_selection, st.session_state.user_query))
+                  on_click=queue_search, args=(handler_text_ranking, st.session_state.index_selection, st.session_state.user_query))
 
         # Button for Hybrid Ranking search using handler_hybrid_ranking
         st.button(label=hybrid_search_label, key="hybrid_search", disabled=search_disabled,
-                  on_click=handler_hybrid_ranking, args=(st.session_state.index_selection, st.session_state.user_query))
+                  on_click=queue_search, args=(handler_hybrid_ranking, st.session_state.index_selection, st.session_state.user_query))
+
+        st.button(label=client_hybrid_search_label, key="client_hybrid_search", disabled=search_disabled,
+                  on_click=queue_search, args=(handler_client_hybrid_ranking, st.session_state.index_selection, st.session_state.user_query))
+        with st.expander("Client-side hybrid settings"):
+            st.slider("Vector weight", 0.0, 2.0, 1.0, 0.1, key="hybrid_vector_weight")
+            st.slider("Text weight", 0.0, 2.0, 1.0, 0.1, key="hybrid_text_weight")
+            st.number_input("Vector candidates", 1, 1000, DEFAULT_CANDIDATE_DEPTH, key="hybrid_vector_depth")
+            st.number_input("Text candidates", 1, 1000, DEFAULT_CANDIDATE_DEPTH, key="hybrid_text_depth")
+            st.number_input("RRF k", 1, 1000, RRF_K, key="hybrid_rrf_k")
 
         search_type = st.radio("Search type", options=["all keywords", "any keywords"], key="full_text_search_type")
 
         st.button(label=full_text_search_label, key="full_text_search", disabled=search_disabled,
-                  on_click=handler_text_search, args=(st.session_state.index_selection, st.session_state.user_query, search_type))
+                  on_click=queue_search, args=(handler_text_search, st.session_state.index_selection, st.session_state.user_query, search_type))
 
 
 
@@ -370,13 +324,53 @@ def render_search():
 
 def render_search_result():
     col1 = st.container()
-    col1.write(f"Executed query: {st.session_state.executed_query}")
+    col1.write("Executed query:")
+    col1.code(st.session_state.executed_query, language="sql")
     col1.write(f"Embedding generation time: {st.session_state.embedding_gen_time}")
+    cache_stats = get_embedding_cache().stats()
+    col1.write(f"Embedding cache: {cache_stats['memory_hits'] + cache_stats['disk_hits']} hits, {cache_stats['misses']} misses ({cache_stats['hit_rate']:.0%} hit rate)")
     col1.write(f"Total end-to-end query execution time: {st.session_state.query_time}")
     col1.write(f"Total server query execution time: {st.session_state.server_query_time}")
     col1.write(f"RU consumed: {st.session_state.ru_consumed}")
-    col1.write(f"Found {len(st.session_state.suggested_listings)} records.")
-    col1.table(st.session_state.suggested_listings)
+    col1.write(f"Pages fetched: {st.session_state.pages_fetched}")
+    result_stats = get_result_cache().stats()
+    col1.write(f"Result cache: {result_stats['hits']} hits, {result_stats['misses']} misses ({result_stats['hit_rate']:.0%} hit rate), {result_stats['ru_saved']:.2f} RU saved")
+    if "time_to_first_query" in st.session_state:
+        col1.write(f"Time to first query in this session: {st.session_state.time_to_first_query}")
+    if st.session_state.get("hybrid_arms"):
+        col1.write("Hybrid arms (run concurrently):")
+        col1.table(pd.DataFrame([{
+            "Arm": name,
+            "Candidates": len(arm.items),
+            "End-to-end time (s)": f"{arm.latency:.4f}",
+            "Server time (s)": f"{arm.server_time:.4f}",
+            "RU consumed": f"{arm.request_charge:.2f}",
+        } for name, arm in st.session_state.hybrid_arms.items()]))
+    if st.session_state.get("index_comparison"):
+        col1.write("Index comparison (queried concurrently):")
+        col1.table(pd.DataFrame([{
+            "Index": result.index,
+            "Records": len(result.items),
+            "Pages": result.pages,
+            "End-to-end time (s)": f"{result.latency:.4f}",
+            "Server time (s)": f"{result.server_time:.4f}",
+            "RU consumed": ru_readout(result),
+        } for result in st.session_state.index_comparison]))
+        col1.write(f"Results below are from {st.session_state.index_comparison[0].index}.")
+    with col1.expander("Latency breakdown (this process)"):
+        st.table(pd.DataFrame([{
+            "Stage": row["name"],
+            "Labels": ", ".join(f"{name}={value}" for name, value in row["labels"].items()),
+            "Count": row["count"],
+            "p50": f"{row['quantiles']['0.5']:.4f}",
+            "p95": f"{row['quantiles']['0.95']:.4f}",
+            "p99": f"{row['quantiles']['0.99']:.4f}",
+        } for row in get_metrics().snapshot()]))
+    listings = st.session_state.suggested_listings
+    col1.write(f"Found {len(listings)} records.")
+    page_count = max(1, -(-len(listings) // RESULT_PAGE_SIZE))
+    page = col1.number_input("Results page", 1, page_count, 1, key="results_page") if page_count > 1 else 1
+    col1.table(listings.iloc[(page - 1) * RESULT_PAGE_SIZE:page * RESULT_PAGE_SIZE])
 
 # Main execution
 render_search()
@@ -385,6 +379,10 @@ st.title(page_title)
 st.write(page_helper)
 st.write("---")
 
+if "pending_search" in st.session_state:
+    handler, args = st.session_state.pop("pending_search")
+    handler(*args)
+
 if "suggested_listings" not in st.session_state:
     st.write(empty_search_helper)
 else:
@@ -0,0 +1,86 @@
+import argparse
+import base64
+import json
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from common.embedding_decode import decode_embeddings, embedding_response
+
+# Per-vector cost of getting embeddings out of an embeddings response, before and after
+# decoding base64 straight into a float32 buffer:
+#   JSON round trip   the app's old path: the OpenAI client converts base64 to Python floats,
+#                     then model_dump_json(indent=2) and json.loads to reach data[0].embedding
+#   float lists       the loader's old path: the client's Python floats, then a float32 array
+#                     for the embedding cache
+#   base64 to buffer  decode_embeddings with encoding_format="base64" into a reused matrix
+# Responses are built locally from seeded random vectors, so no OpenAI key is needed.
+#
+# how to call:
+# python src/bench/embedding_decode_benchmark.py --iterations 200 --batch_sizes 1,16
+
+
+def client_float_lists(response):
+    # What the OpenAI client does to a base64 response when encoding_format is not given
+    for data in response.data:
+        data.embedding = np.frombuffer(base64.b64decode(data.embedding), dtype="float32").tolist()
+    return response
+
+
+def json_round_trip(response):
+    response = client_float_lists(response)
+    parsed_response = json.loads(response.model_dump_json(indent=2))
+    return [data['embedding'] for data in parsed_response['data']]
+
+
+def float_lists(response):
+    response = client_float_lists(response)
+    return [np.asarray(data.embedding, dtype=np.float32) for data in response.data]
+
+
+def time_case(decode, make_response, iterations):
+    samples = []
+    for _ in range(iterations):
+        # A fresh response each time, since the client's conversion rewrites it in place
+        response = make_response()
+        start = time.perf_counter()
+        decode(response)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare ways of decoding embedding responses.')
+    parser.add_argument('--iterations', type=int, default=200, help='Responses decoded per case.')
+    parser.add_argument('--dimensions', type=int, default=1536, help='Dimensions of each embedding.')
+    parser.add_argument('--batch_sizes', type=str, default="1,16", help='Comma-separated numbers of embeddings per response.')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    for batch_size in map(int, args.batch_sizes.split(",")):
+        vectors = rng.uniform(-0.1, 0.1, (batch_size, args.dimensions)).astype(np.float32)
+        make_response = lambda: embedding_response(vectors, "benchmark", encoding_format="base64")
+        buffer = np.empty((batch_size, args.dimensions), dtype=np.float32)
+        cases = [
+            ("JSON round trip", json_round_trip),
+            ("float lists", float_lists),
+            ("base64 to buffer", lambda response: decode_embeddings(response, out=buffer)),
+        ]
+        decoded = decode_embeddings(make_response(), out=buffer)
+        assert np.array_equal(decoded, vectors), "base64 decoding changed the vectors"
+        print(f"{batch_size} embeddings of {args.dimensions} dimensions per response:")
+        baseline = None
+        for name, decode in cases:
+            samples = time_case(decode, make_response, args.iterations)
+            per_vector = statistics.median(samples) / batch_size
+            baseline = baseline or per_vector
+            print(f"  {name:<18} p50 {per_vector * 1e6:8.1f} us per vector ({baseline / per_vector:5.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+import argparse
+import concurrent.futures
+import csv
+import json
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+from dotenv import load_dotenv
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from common.embedding_cache import cache_from_env
+from common.embedding_decode import ENCODING_FORMAT, decode_embeddings
+from common.local_backend import LocalCosmosClient, fake_embedding
+from common.provisioning import DATABASE_NAME, openai_embeddings_dimensions, provision, transform_policy
+from common.queries import query_keywords, vector_search_query
+from common.search_service import DEFAULT_CANDIDATE_DEPTH, INDEX_CONTAINERS, RRF_K, SearchService
+from common.vector_transform import transform_from_env
+
+# Replays a query workload against each index type at a fixed concurrency and reports latency
+# percentiles and histogram, throughput, RU per query and recall@k, for vector search or client-side
+# hybrid search. Recall is measured against the same search on the No Index container, whose
+# vector search is an exact scan. With --backend local the workload runs against an in-process
+# stand-in filled with a synthetic corpus, so no network access is needed.
+#
+# how to call:
+# python src/bench/index_benchmark.py --backend local --documents 20000 --concurrency 8 --output_json bench.json --output_csv bench.csv
+# python src/bench/index_benchmark.py --mode hybrid --vector_depth 20 --text_depth 100 --text_weight 0.5
+# python src/bench/index_benchmark.py --backend cosmos --queries queries.txt --database_name "ignite2024demo"
+
+# Upper bounds of the latency histogram buckets, in milliseconds
+HISTOGRAM_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, float("inf")]
+
+
+def synthetic_corpus(documents, vocabulary_size, words_per_document, seed=0):
+    rng = np.random.default_rng(seed)
+    vocabulary = [f"w{position:05d}" for position in range(vocabulary_size)]
+    # Zipf-like word frequencies, so some words are common and full-text queries vary in selectivity
+    weights = 1.0 / np.arange(1, vocabulary_size + 1)
+    weights /= weights.sum()
+    choices = rng.choice(vocabulary_size, (documents, words_per_document), p=weights)
+    for position, words in enumerate(choices):
+        yield {"id": str(position), "title": f"Document {position}", "text": " ".join(vocabulary[word] for word in words)}
+
+
+def synthetic_queries(corpus, count, words_per_query, seed=1):
+    # Each query is a handful of words from one document, so every query has relevant documents
+    rng = np.random.default_rng(seed)
+    queries = []
+    for position in rng.choice(len(corpus), count, replace=len(corpus) < count):
+        words = corpus[position]["text"].split()
+        queries.append(" ".join(rng.choice(words, min(words_per_query, len(words)), replace=False)))
+    return queries
+
+
+def load_local_backend(args, transform=None):
+    print(f"Generating and loading {args.documents} synthetic documents into the local backend...")
+    start = time.perf_counter()
+    client = LocalCosmosClient()
+    database = provision(client, args.database_name, **transform_policy(transform, args.dimensions))
+    corpus = list(synthetic_corpus(args.documents, args.vocabulary, args.words_per_document))
+    for document in corpus:
+        embedding = fake_embedding(document["text"], args.dimensions)
+        document["embedding"] = transform.encode(embedding) if transform is not None else embedding
+        for name in INDEX_CONTAINERS.values():
+            database.get_container_client(name).upsert_item(document)
+    print(f"Loaded in {time.perf_counter() - start:.1f} seconds.")
+    return database, corpus
+
+
+def open_local_store(args):
+    # A store filled by the data loader with --backend local; queries are drawn from its documents
+    database = LocalCosmosClient(args.local_path).get_database_client(args.database_name)
+    corpus = [item for item in database.get_container_client(INDEX_CONTAINERS["No Index"]).read_all_items()
+              if isinstance(item.get("text"), str)]
+    print(f"Opened {args.local_path} with {len(corpus)} documents.")
+    return database, corpus
+
+
+def connect_cosmos(args):
+    from common.clients import create_cosmos_client
+    return create_cosmos_client().get_database_client(args.database_name)
+
+
+def openai_embedder():
+    from common.clients import create_openai_client, embedding_model
+    client = create_openai_client()
+    # The client follows EMBEDDING_BACKEND, so the model name does too; it is also the cache key
+    model = embedding_model()
+    cache = cache_from_env()
+
+    def embed(text):
+        vector = cache.get(model, text)
+        if vector is None:
+            vector = decode_embeddings(client.embeddings.create(input=text, model=model, encoding_format=ENCODING_FORMAT))[0]
+            cache.put(model, text, vector)
+        return list(vector)
+    return embed
+
+
+def local_model_embedder():
+    # Concurrent workers' queries are micro-batched into shared forward passes
+    from common.clients import local_embedder
+    embedder = local_embedder()
+    return lambda text: embedder.embed([text])[0].tolist()
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def histogram(latencies_ms):
+    counts = [0] * len(HISTOGRAM_BUCKETS_MS)
+    for latency in latencies_ms:
+        counts[next(position for position, bound in enumerate(HISTOGRAM_BUCKETS_MS) if latency <= bound)] += 1
+    return {f"<={bound:g}ms" if bound != float("inf") else "more": count for bound, count in zip(HISTOGRAM_BUCKETS_MS, counts)}
+
+
+def recall_at_k(results, truth, k):
+    # Queries whose exact search failed have no truth to score against
+    found = [len({item["id"] for item in result.items[:k]} & truth_ids) / max(1, min(k, len(truth_ids)))
+             for result, truth_ids in zip(results, truth) if truth_ids is not None]
+    return statistics.mean(found) if found else 0.0
+
+
+def run_workload(search, index, workload, concurrency, rounds):
+    """Run search(index, query) for every query `rounds` times at the given concurrency; returns results in workload order and wall time."""
+    jobs = [query for _ in range(rounds) for query in workload]
+    # One untimed query first, so index builds and connection setup are not counted
+    search(index, workload[0])
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(lambda query: search(index, query), jobs))
+    return results, time.perf_counter() - start
+
+
+def summarize(index, results, wall_time, truth, k):
+    errors = [result for result in results if result.error is not None]
+    # Results repeat the workload round after round; each keeps its query's truth before errors are dropped
+    query_truth = [truth[position % len(truth)] for position, result in enumerate(results) if result.error is None]
+    results = [result for result in results if result.error is None]
+    latencies_ms = [result.latency * 1000 for result in results]
+    charges = [result.request_charge for result in results]
+    if not results:
+        return {"index": index, "queries": 0, "errors": len(errors), "first_error": str(errors[0].error) if errors else None}
+    return {
+        "index": index,
+        "queries": len(results),
+        "errors": len(errors),
+        "throughput_qps": len(results) / wall_time,
+        "latency_ms_mean": statistics.mean(latencies_ms),
+        "latency_ms_p50": percentile(latencies_ms, 0.50),
+        "latency_ms_p95": percentile(latencies_ms, 0.95),
+        "latency_ms_p99": percentile(latencies_ms, 0.99),
+        "server_ms_mean": statistics.mean(result.server_time * 1000 for result in results),
+        "ru_mean": statistics.mean(charges),
+        "ru_total": sum(charges),
+        f"recall_at_{k}": recall_at_k(results, query_truth, k),
+        "latency_histogram": histogram(latencies_ms),
+        "first_error": str(errors[0].error) if errors else None,
+    }
+
+
+def write_csv(path, run, summaries):
+    if not summaries:
+        print(f"No index completed a query; nothing was appended to {path}.")
+        return
+    # Rows are appended so one file collects every run for comparison over time
+    columns = ["run", "backend", "mode", "concurrency", "top_k"] + [
+        name for name in summaries[0] if name not in ("latency_histogram", "first_error")]
+    exists = os.path.exists(path) and os.path.getsize(path) > 0
+    with open(path, "a", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=columns, extrasaction="ignore")
+        if not exists:
+            writer.writeheader()
+        for summary in summaries:
+            writer.writerow({"run": run["started"], "backend": run["backend"], "mode": run["mode"],
+                             "concurrency": run["concurrency"], "top_k": run["top_k"], **summary})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark vector search across the No Index, QFLAT and DiskANN containers.")
+    parser.add_argument("--backend", choices=["local", "cosmos"], default="local", help="Query the in-process stand-in or the Cosmos DB account in .env.")
+    parser.add_argument("--database_name", default=DATABASE_NAME, help="Database holding the three containers.")
+    parser.add_argument("--mode", choices=["vector", "hybrid"], default="vector", help="Vector search, or client-side hybrid search fusing vector and full-text arms with weighted RRF.")
+    parser.add_argument("--vector_depth", type=int, default=DEFAULT_CANDIDATE_DEPTH, help="Hybrid mode: candidates fetched by the vector arm.")
+    parser.add_argument("--text_depth", type=int, default=DEFAULT_CANDIDATE_DEPTH, help="Hybrid mode: candidates fetched by the full-text arm.")
+    parser.add_argument("--vector_weight", type=float, default=1.0, help="Hybrid mode: RRF weight of the vector arm.")
+    parser.add_argument("--text_weight", type=float, default=1.0, help="Hybrid mode: RRF weight of the full-text arm.")
+    parser.add_argument("--rrf_k", type=int, default=RRF_K, help="Hybrid mode: the k in 1 / (k + rank).")
+    parser.add_argument("--indexes", nargs="+", choices=list(INDEX_CONTAINERS), default=list(INDEX_CONTAINERS), help="Index types to benchmark.")
+    parser.add_argument("--queries", help="File with one query text per line; defaults to queries drawn from the synthetic corpus (local backend only).")
+    parser.add_argument("--num_queries", type=int, default=200, help="Number of synthetic queries when --queries is not given.")
+    parser.add_argument("--rounds", type=int, default=3, help="Times the workload is replayed against each index.")
+    parser.add_argument("--concurrency", type=int, default=8, help="Queries in flight at once.")
+    parser.add_argument("--top_k", type=int, default=10, help="Results per query, and the k in recall@k.")
+    parser.add_argument("--embedder", choices=["openai", "local", "fake"], help="How query texts are embedded; defaults to openai for Cosmos DB and fake for the local backend. local runs LOCAL_EMBEDDING_MODEL on the CPU.")
+    parser.add_argument("--local_path", help="With --backend local, query this store filled by the data loader instead of a synthetic corpus.")
+    parser.add_argument("--documents", type=int, default=20000, help="Synthetic documents loaded into the local backend.")
+    parser.add_argument("--dimensions", type=int, default=openai_embeddings_dimensions, help="Vector dimensions in the local backend.")
+    parser.add_argument("--vocabulary", type=int, default=5000, help="Distinct words in the synthetic corpus.")
+    parser.add_argument("--words_per_document", type=int, default=40, help="Words per synthetic document.")
+    parser.add_argument("--vector_transform", default=os.getenv("VECTOR_TRANSFORM_PATH"), help="Transform from vector_compaction.py that the stored vectors were written with (defaults to VECTOR_TRANSFORM_PATH); query vectors are encoded with it, as the app does.")
+    parser.add_argument("--output_json", help="Write the run's settings and results to this JSON file.")
+    parser.add_argument("--output_csv", help="Append one row per index to this CSV file.")
+    args = parser.parse_args()
+
+    load_dotenv()
+    transform = transform_from_env(args.vector_transform)
+    corpus = None
+    if args.backend == "local":
+        database, corpus = open_local_store(args) if args.local_path else load_local_backend(args, transform)
+    else:
+        database = connect_cosmos(args)
+    # Query vectors must come from the model that embedded the documents
+    embedder = args.embedder or ("openai" if args.backend == "cosmos" else "fake")
+    if embedder == "fake":
+        embed = lambda text: fake_embedding(text, args.dimensions).tolist()
+    elif embedder == "local":
+        embed = local_model_embedder()
+    else:
+        embed = openai_embedder()
+    if transform is not None:
+        # Queries must be in the same reduced space and encoding as the stored vectors
+        embed_full = embed
+        embed = lambda text: transform.encode(embed_full(text))
+
+    if args.queries:
+        with open(args.queries, encoding="utf-8") as file:
+            texts = [line.strip() for line in file if line.strip()]
+    elif corpus is not None:
+        texts = synthetic_queries(corpus, args.num_queries, 4)
+    else:
+        parser.error("--queries is required with --backend cosmos")
+
+    service = SearchService(database)
+    if args.mode == "vector":
+        workload = [vector_search_query(embed(text), args.top_k) for text in texts]
+        search = lambda index, query: service.search_index(index, *query)
+    else:
+        workload = [(embed(text), query_keywords(text)) for text in texts]
+        options = dict(top_k=args.top_k, vector_depth=args.vector_depth, text_depth=args.text_depth,
+                       vector_weight=args.vector_weight, text_weight=args.text_weight, rrf_k=args.rrf_k)
+        search = lambda index, query: service.hybrid_search_index(index, *query, **options)
+
+    # Results from the No Index container, whose vector search is exact, are the reference for recall
+    print(f"Computing exact top {args.top_k} for {len(workload)} queries...")
+    reference, _ = run_workload(search, "No Index", workload, args.concurrency, 1)
+    truth = [{item["id"] for item in result.items} if result.error is None else None for result in reference]
+
+    run = {
+        "started": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "backend": args.backend,
+        "database": args.database_name,
+        "queries": len(workload),
+        "rounds": args.rounds,
+        "concurrency": args.concurrency,
+        "top_k": args.top_k,
+        "mode": args.mode,
+        "hybrid": options if args.mode == "hybrid" else None,
+        "documents": len(corpus) if corpus is not None else None,
+    }
+    summaries = []
+    for index in args.indexes:
+        results, wall_time = run_workload(search, index, workload, args.concurrency, args.rounds)
+        summary = summarize(index, results, wall_time, truth, args.top_k)
+        summaries.append(summary)
+        if not summary["queries"]:
+            print(f"{index}: all {summary['errors']} queries failed: {summary['first_error']}")
+            continue
+        print(f"{index}: {summary['throughput_qps']:.1f} q/s, "
+              f"p50 {summary['latency_ms_p50']:.1f} ms, p95 {summary['latency_ms_p95']:.1f} ms, p99 {summary['latency_ms_p99']:.1f} ms, "
+              f"{summary['ru_mean']:.2f} RU/query, recall@{args.top_k} {summary[f'recall_at_{args.top_k}']:.3f}"
+              + (f", {summary['errors']} errors, first: {summary['first_error']}" if summary["errors"] else ""))
+        print("    " + "  ".join(f"{bucket}: {count}" for bucket, count in summary["latency_histogram"].items() if count))
+
+    if args.output_json:
+        with open(args.output_json, "w", encoding="utf-8") as file:
+            json.dump({"run": run, "results": summaries}, file, indent=2)
+    if args.output_csv:
+        write_csv(args.output_csv, run, [summary for summary in summaries if summary["queries"]])
+
+
+if __name__ == "__main__":
+    main()
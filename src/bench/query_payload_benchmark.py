@@ -0,0 +1,115 @@
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+from azure.cosmos import CosmosClient
+from dotenv import load_dotenv
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from common.queries import hybrid_ranking_query, query_keywords, vector_search_query
+
+# Compares the old inlined queries with the parameterized ones: request body size, the client-side
+# cost of building and serializing the body and, with --live, end-to-end latency and RU against a
+# container. A seeded random vector stands in for the query embedding, so no OpenAI key is needed.
+#
+# how to call:
+# python src/bench/query_payload_benchmark.py --iterations 200
+# python src/bench/query_payload_benchmark.py --live --database_name "ignite2024demo" --container_name "search_diskann"
+
+
+def inline_vector_search_query(vector, top_k):
+    # The query as the app built it before parameterization
+    return f'''
+    SELECT TOP {top_k} l.id, l.title, l.text, VectorDistance(l.embedding, {vector}) as SimilarityScore
+    FROM l
+    ORDER BY VectorDistance(l.embedding,{vector})
+    ''', []
+
+
+def inline_hybrid_ranking_query(keywords, vector, top_k):
+    formatted_keywords = ', '.join(f'"{keyword}"' for keyword in keywords)
+    return f'''
+    SELECT TOP {top_k} l.id, l.title, l.text
+    FROM l
+    ORDER BY RANK RRF(FullTextScore(l.text,[{formatted_keywords}]),VectorDistance(l.embedding, {vector}))
+    ''', []
+
+
+def request_body(query, parameters):
+    return json.dumps({"query": query, "parameters": parameters})
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def time_build(build, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        body = request_body(*build())
+        samples.append(time.perf_counter() - start)
+    return len(body.encode("utf-8")), samples
+
+
+def time_live(container, build, iterations):
+    samples = []
+    charges = []
+    for _ in range(iterations):
+        query, parameters = build()
+        start = time.perf_counter()
+        list(container.query_items(query, parameters=parameters or None, enable_cross_partition_query=True))
+        samples.append(time.perf_counter() - start)
+        charges.append(float(container.client_connection.last_response_headers.get('x-ms-request-charge', 0)))
+    return samples, charges
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare inlined and parameterized search queries.')
+    parser.add_argument('--iterations', type=int, default=100, help='Times each query is built (and run, with --live).')
+    parser.add_argument('--dimensions', type=int, default=1536, help='Dimensions of the stand-in query vector.')
+    parser.add_argument('--text', type=str, default="A Cantorian fractal spacetime", help='Search text for the keyword half of the hybrid query.')
+    parser.add_argument('--live', action='store_true', help='Also run the queries against a container, using AZURE_COSMOSDB_ENDPOINT and AZURE_COSMOSDB_KEY.')
+    parser.add_argument('--database_name', type=str, default='ignite2024demo', help='Database to query with --live.')
+    parser.add_argument('--container_name', type=str, default='search_diskann', help='Container to query with --live.')
+    args = parser.parse_args()
+
+    vector = np.random.default_rng(0).uniform(-0.1, 0.1, args.dimensions).tolist()
+    keywords = query_keywords(args.text)
+    top_k = 10
+    # Full text in both, so only parameterization differs
+    cases = [
+        ("vector, inline", lambda: inline_vector_search_query(vector, top_k)),
+        ("vector, parameterized", lambda: vector_search_query(vector, top_k, snippet_length=None)),
+        ("hybrid, inline", lambda: inline_hybrid_ranking_query(keywords, vector, top_k)),
+        ("hybrid, parameterized", lambda: hybrid_ranking_query(keywords, vector, top_k, snippet_length=None)),
+    ]
+
+    container = None
+    if args.live:
+        load_dotenv()
+        client = CosmosClient(os.getenv("AZURE_COSMOSDB_ENDPOINT"), credential=os.getenv("AZURE_COSMOSDB_KEY"))
+        container = client.get_database_client(args.database_name).get_container_client(args.container_name)
+
+    for name, build in cases:
+        query, _ = build()
+        body_bytes, build_samples = time_build(build, args.iterations)
+        line = (f"{name:<22} query text {len(query.encode('utf-8')):>7} B, request body {body_bytes:>7} B, "
+                f"build+serialize p50 {statistics.median(build_samples) * 1e6:7.0f} us")
+        if container is not None:
+            # One unmeasured run so connection setup is not counted
+            time_live(container, build, 1)
+            samples, charges = time_live(container, build, args.iterations)
+            line += (f", latency p50 {statistics.median(samples) * 1000:.1f} ms p95 {percentile(samples, 0.95) * 1000:.1f} ms"
+                     f", {statistics.mean(charges):.2f} RU")
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import os
+
+import requests
+from azure.core.pipeline.transport import RequestsTransport
+from azure.cosmos import CosmosClient
+from openai import AzureOpenAI
+
+from common.local_backend import DEFAULT_LOCAL_BACKEND_PATH, FAKE_EMBEDDING_MODEL, FakeEmbeddingsClient, LocalCosmosClient
+from common.local_embedder import LocalEmbeddingsClient, local_embedding_model, local_embedding_runtime, shared_local_embedder
+from common.provisioning import configured_dimensions, embedding_dimensions, openai_embeddings_dimensions
+
+# Sized for several sessions each fanning a search out to all three containers; requests
+# otherwise keeps only 10 connections per host and discards the rest after each burst
+DEFAULT_POOL_SIZE = 64
+
+OPENAI_EMBEDDING_MODEL = "text-embedding-ada-002"
+
+
+# SEARCH_BACKEND=local swaps Cosmos DB for the in-process stand-in in common/local_backend.py,
+# kept in LOCAL_BACKEND_PATH; EMBEDDING_BACKEND=fake swaps OpenAI for its deterministic embedder,
+# and EMBEDDING_BACKEND=local for a CPU model in this process (common/local_embedder.py)
+def search_backend():
+    return os.getenv("SEARCH_BACKEND", "cosmos")
+
+
+def embedding_backend():
+    return os.getenv("EMBEDDING_BACKEND", "openai")
+
+
+def local_backend_path():
+    return os.getenv("LOCAL_BACKEND_PATH", DEFAULT_LOCAL_BACKEND_PATH)
+
+
+def embedding_model(backend=None):
+    """The model name embeddings are cached under, which includes the dimensions where those are configurable."""
+    backend = backend or embedding_backend()
+    dimensions = embedding_dimensions(backend)
+    if backend == "local":
+        return f"{local_embedding_model()}@{dimensions}"
+    if backend == "fake":
+        return FAKE_EMBEDDING_MODEL if dimensions == openai_embeddings_dimensions else f"{FAKE_EMBEDDING_MODEL}@{dimensions}"
+    return OPENAI_EMBEDDING_MODEL
+
+
+def local_embedder():
+    # Unset EMBEDDING_DIMENSIONS keeps the model's own, under the same shared embedder embedding_dimensions loads
+    return shared_local_embedder(local_embedding_model(), local_embedding_runtime(), configured_dimensions())
+
+
+def create_cosmos_client(endpoint=None, key=None, pool_size=DEFAULT_POOL_SIZE):
+    """A Cosmos DB client meant to be shared by every thread in the process."""
+    if search_backend() == "local":
+        return LocalCosmosClient(local_backend_path())
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return CosmosClient(endpoint or os.getenv("AZURE_COSMOSDB_ENDPOINT"),
+                        credential=key or os.getenv("AZURE_COSMOSDB_KEY"),
+                        transport=RequestsTransport(session=session))
+
+
+def create_openai_client():
+    if embedding_backend() == "fake":
+        return FakeEmbeddingsClient(embedding_dimensions())
+    if embedding_backend() == "local":
+        return LocalEmbeddingsClient(local_embedder(), embedding_model())
+    # The OpenAI client keeps its own httpx connection pool and is safe to share across threads
+    return AzureOpenAI(
+        api_key=os.getenv("AZURE_OPENAI_APIKEY"),
+        api_version="2023-05-15",
+        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT")
+    )
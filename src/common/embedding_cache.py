@@ -0,0 +1,164 @@
+import collections
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+
+import numpy as np
+
+DEFAULT_CACHE_PATH = "embedding-cache.sqlite"
+DEFAULT_MEMORY_ENTRIES = 1024
+DEFAULT_MAX_DISK_MB = 512
+
+
+def normalize_text(text):
+    # Texts that differ only in unicode form or whitespace embed the same for our purposes
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def cache_key(model, text):
+    return hashlib.sha256(f"{model}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """Content-addressed embedding cache: an in-process LRU in front of a SQLite file of float32 vectors.
+
+    Keys combine the model name and the normalized text, so the app and the loader can share
+    one file. When the file grows past max_disk_bytes the least recently used tenth is evicted.
+    A path of None keeps the cache in memory only.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, memory_entries=DEFAULT_MEMORY_ENTRIES,
+                 max_disk_bytes=DEFAULT_MAX_DISK_MB * 1024 * 1024):
+        self.memory_entries = memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._connection = None
+        self._disk_bytes = 0
+        if path:
+            # Streamlit serves sessions from several threads; every use goes through the lock. The
+            # file is also shared with the app and loader workers, so wait for their writes to finish
+            self._connection = sqlite3.connect(path, check_same_thread=False, timeout=60)
+            with self._connection:
+                self._connection.execute(
+                    "CREATE TABLE IF NOT EXISTS embeddings ("
+                    "key TEXT PRIMARY KEY, vector BLOB NOT NULL, accessed REAL NOT NULL)"
+                )
+                self._connection.execute("CREATE INDEX IF NOT EXISTS embeddings_accessed ON embeddings (accessed)")
+            self._disk_bytes = self._connection.execute(
+                "SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+
+    def get(self, model, text):
+        return self.get_many(model, [text])[0]
+
+    def put(self, model, text, vector):
+        self.put_many(model, [text], [vector])
+
+    def get_many(self, model, texts):
+        """Return a float32 vector per text, or None where the text has not been cached."""
+        keys = [cache_key(model, text) for text in texts]
+        vectors = [None] * len(texts)
+        with self._lock:
+            missing = []
+            for position, key in enumerate(keys):
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    vectors[position] = vector
+                else:
+                    missing.append(position)
+
+            if missing and self._connection is not None:
+                found = {}
+                missing_keys = [keys[position] for position in missing]
+                # Stay well under SQLite's limit on bound parameters
+                for start in range(0, len(missing_keys), 500):
+                    chunk = missing_keys[start:start + 500]
+                    placeholders = ",".join("?" * len(chunk))
+                    rows = self._connection.execute(
+                        f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk)
+                    found.update((key, np.frombuffer(blob, dtype=np.float32)) for key, blob in rows)
+                if found:
+                    with self._connection:
+                        self._connection.executemany(
+                            "UPDATE embeddings SET accessed = ? WHERE key = ?",
+                            [(time.time(), key) for key in found])
+                for position in missing:
+                    vector = found.get(keys[position])
+                    if vector is not None:
+                        self.disk_hits += 1
+                        vectors[position] = vector
+                        self._remember(keys[position], vector)
+
+            self.misses += sum(vector is None for vector in vectors)
+        return vectors
+
+    def put_many(self, model, texts, vectors):
+        rows = []
+        with self._lock:
+            for text, vector in zip(texts, vectors):
+                if vector is None:
+                    continue
+                key = cache_key(model, text)
+                vector = np.asarray(vector, dtype=np.float32)
+                self._remember(key, vector)
+                rows.append((key, vector.tobytes(), time.time()))
+
+            if rows and self._connection is not None:
+                with self._connection:
+                    self._connection.executemany(
+                        "INSERT OR REPLACE INTO embeddings (key, vector, accessed) VALUES (?, ?, ?)", rows)
+                self._disk_bytes += sum(len(blob) for _, blob, _ in rows)
+                if self._disk_bytes > self.max_disk_bytes:
+                    self._evict()
+
+    def _remember(self, key, vector):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict(self):
+        # Drop the least recently used tenth at a time rather than one row per insert
+        while self._disk_bytes > self.max_disk_bytes:
+            count = self._connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            with self._connection:
+                self._connection.execute(
+                    "DELETE FROM embeddings WHERE key IN "
+                    "(SELECT key FROM embeddings ORDER BY accessed LIMIT ?)", (max(1, count // 10),))
+            self._disk_bytes = self._connection.execute(
+                "SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+
+    def stats(self):
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        hits = self.memory_hits + self.disk_hits
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "disk_bytes": self._disk_bytes,
+        }
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+def cache_from_env(path=None):
+    """Build the cache configured by EMBEDDING_CACHE_PATH and EMBEDDING_CACHE_MAX_MB.
+
+    Setting EMBEDDING_CACHE_PATH to an empty string keeps the cache in memory only.
+    """
+    if path is None:
+        path = os.getenv("EMBEDDING_CACHE_PATH", DEFAULT_CACHE_PATH)
+    max_disk_mb = float(os.getenv("EMBEDDING_CACHE_MAX_MB", DEFAULT_MAX_DISK_MB))
+    return EmbeddingCache(path or None, max_disk_bytes=int(max_disk_mb * 1024 * 1024))
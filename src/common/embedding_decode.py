@@ -0,0 +1,58 @@
+import base64
+
+import numpy as np
+from openai.types import CreateEmbeddingResponse, Embedding
+from openai.types.create_embedding_response import Usage
+
+# Embedding requests ask for base64, the float32 bytes of each vector, rather than JSON numbers.
+# Given encoding_format explicitly, the OpenAI client hands the base64 string through untouched,
+# and decode_embeddings copies its bytes straight into a float32 matrix. Without it the client
+# converts each vector to a list of Python floats, which callers then convert back.
+ENCODING_FORMAT = "base64"
+
+
+def decode_embedding(value, out):
+    """Fill the float32 row out with one embedding, given as base64 or as a list of numbers."""
+    if isinstance(value, str):
+        out[:] = np.frombuffer(base64.b64decode(value), dtype="<f4")
+    else:
+        out[:] = value
+    return out
+
+
+def _dimensions(value):
+    # Four bytes per float32, and base64 packs three bytes into four characters
+    if isinstance(value, str):
+        return (len(value) * 3 // 4 - value.count("=", -2)) // 4
+    return len(value)
+
+
+def decode_embeddings(response, out=None):
+    """The response's embeddings as rows of a float32 matrix, in input order.
+
+    Rows are written into out when it is given, which must have a row per input; otherwise one
+    matrix is allocated for the whole response rather than one array per vector.
+    """
+    data = response.data
+    if out is None:
+        out = np.empty((len(data), _dimensions(data[0].embedding) if data else 0), dtype=np.float32)
+    for item in data:
+        decode_embedding(item.embedding, out[item.index])
+    return out[:len(data)]
+
+
+def encode_embedding(vector):
+    return base64.b64encode(np.asarray(vector, dtype="<f4").tobytes()).decode("ascii")
+
+
+def embedding_response(vectors, model, encoding_format=None):
+    """A CreateEmbeddingResponse for stand-in embedders, in the requested encoding like the service's."""
+    if encoding_format == "base64":
+        # Constructed without validation, as the OpenAI client does, since base64 is not a list of floats
+        data = [Embedding.model_construct(embedding=encode_embedding(vector), index=position, object="embedding")
+                for position, vector in enumerate(vectors)]
+    else:
+        data = [Embedding(embedding=np.asarray(vector, dtype=np.float32).tolist(), index=position, object="embedding")
+                for position, vector in enumerate(vectors)]
+    return CreateEmbeddingResponse.model_construct(data=data, model=model, object="list",
+                                                   usage=Usage(prompt_tokens=0, total_tokens=0))
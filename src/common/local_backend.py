@@ -0,0 +1,833 @@
+import asyncio
+import collections
+import functools
+import hashlib
+import json
+import math
+import re
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from common.embedding_decode import embedding_response
+
+# An in-process stand-in for the demo's Cosmos DB database, for benchmarking and development
+# without network access. It mirrors the parts of the Cosmos clients the app and the loader use
+# (create_database_if_not_exists, create_container_if_not_exists, get_container_client,
+# upsert_item, execute_item_batch and query_items with a response_hook, max_item_count and
+# by_page continuation tokens) and answers the queries built in common/queries.py:
+#   VectorDistance        cosine similarity over a contiguous float32 matrix, by index type:
+#                           no vector index  exact, every vector is scanned
+#                           quantizedFlat    every vector is scanned in int8-quantized form
+#                           diskANN          approximate: an inverted-file index over k-means
+#                                            clusters, probing the nearest lists
+#   FullTextContainsAll/Any, FullTextScore (BM25) and RRF over an inverted index of words.
+#                         Words are lowercased but not stemmed, and stop words are kept.
+#   SUBSTRING             in the projection, for result snippets.
+# Responses carry simulated x-ms-request-charge and x-ms-documentdb-query-metrics headers. The
+# charges follow the shape of the service's (a fixed cost plus a cost per document, vector or
+# posting read) but are not calibrated against it. With a path, documents are kept in a SQLite
+# file, so the loader can fill it and the app query it from another process.
+
+DEFAULT_LOCAL_BACKEND_PATH = "local-backend.sqlite"
+FAKE_EMBEDDING_MODEL = "fake-word-hash"
+
+# Simulated RU: a fixed cost per query and per document returned, plus what the query reads
+BASE_QUERY_CHARGE = 2.3
+CHARGE_PER_RESULT = 0.05
+CHARGE_PER_VECTOR_SCANNED = {None: 0.02, 'quantizedFlat': 0.004, 'diskANN': 0.004}
+CHARGE_PER_POSTING = 0.001
+# Without a full-text index every document's text is read
+CHARGE_PER_TEXT_SCANNED = 0.01
+WRITE_BASE_CHARGE = 5.0
+WRITE_CHARGE_PER_KB = 1.0
+VECTOR_JSON_BYTES_PER_FLOAT = 20
+VECTOR_SIZE_SAMPLE = 64
+
+# Inverted-file settings for the diskANN stand-in
+IVF_MIN_DOCUMENTS = 1000
+IVF_PROBE_FRACTION = 0.1
+IVF_KMEANS_ITERATIONS = 8
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+# The k in 1 / (k + rank), and how many candidates each ranking contributes to the fusion
+RRF_K = 60
+RRF_CANDIDATES = 100
+
+_WORD = re.compile(r"\w+")
+_QUERY = re.compile(
+    r"^\s*SELECT\s+(?:TOP\s+(\d+|@\w+)\s+)?(.*?)\s+FROM\s+(\w+)"
+    r"(?:\s+WHERE\s+(.*?))?(?:\s+ORDER\s+BY\s+(?:RANK\s+)?(.*?))?\s*$",
+    re.IGNORECASE | re.DOTALL)
+_CALL = re.compile(r"^(\w+)\s*\((.*)\)$", re.DOTALL)
+_FIELD = re.compile(r"^(\w+)\.(\w+)$")
+_ALIAS = re.compile(r"^(.*?)\s+as\s+(\w+)$", re.IGNORECASE | re.DOTALL)
+
+_Field = collections.namedtuple("_Field", "name")
+_Call = collections.namedtuple("_Call", "function arguments")
+
+
+def tokenize(text):
+    return _WORD.findall(text.lower()) if isinstance(text, str) else []
+
+
+def fake_embedding(text, dimensions=1536):
+    """A deterministic stand-in for an embedding model: the normalized sum of one random vector per word.
+
+    Texts sharing words get similar vectors, which is enough for search to return plausible
+    results and for recall to be measured, without calling an embedding service.
+    """
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for word in tokenize(text):
+        vector += _word_vector(word, dimensions)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+@functools.lru_cache(maxsize=100000)
+def _word_vector(word, dimensions):
+    seed = int.from_bytes(hashlib.sha256(word.encode("utf-8")).digest()[:8], "little")
+    return np.random.default_rng(seed).standard_normal(dimensions, dtype=np.float32)
+
+
+class FakeEmbeddingsClient:
+    """Stands in for AzureOpenAI's embeddings API, answering with fake_embedding."""
+
+    def __init__(self, dimensions=1536):
+        self.dimensions = dimensions
+        self.embeddings = self
+
+    def create(self, input, model=None, encoding_format=None, **kwargs):
+        texts = [input] if isinstance(input, str) else input
+        return embedding_response([fake_embedding(text, self.dimensions) for text in texts], FAKE_EMBEDDING_MODEL, encoding_format)
+
+
+class AsyncFakeEmbeddingsClient(FakeEmbeddingsClient):
+    """Stands in for AsyncAzureOpenAI's embeddings API, answering with fake_embedding."""
+
+    async def create(self, input, model=None, encoding_format=None, **kwargs):
+        texts = [input] if isinstance(input, str) else input
+        return embedding_response([fake_embedding(text, self.dimensions) for text in texts], FAKE_EMBEDDING_MODEL, encoding_format)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+
+def _normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _top_k(scores, k):
+    if k >= len(scores):
+        return np.argsort(-scores, kind="stable")
+    candidates = np.argpartition(-scores, k)[:k]
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+def _split_top_level(text):
+    # Split on commas that are not inside parentheses, brackets or quotes
+    parts, depth, quote, current = [], 0, None, ""
+    for character in text:
+        if quote:
+            quote = None if character == quote else quote
+        elif character in "'\"":
+            quote = character
+        elif character in "([":
+            depth += 1
+        elif character in ")]":
+            depth -= 1
+        elif character == "," and depth == 0:
+            parts.append(current.strip())
+            current = ""
+            continue
+        current += character
+    if current.strip():
+        parts.append(current.strip())
+    return parts
+
+
+def _parse_expression(text, values):
+    text = text.strip()
+    if text.startswith("@"):
+        if text not in values:
+            raise ValueError(f"Query parameter {text} was not given")
+        return values[text]
+    if text[:1] in ("'", '"'):
+        return text[1:-1]
+    if text.startswith("["):
+        return [_parse_expression(part, values) for part in _split_top_level(text[1:-1])]
+    match = _FIELD.match(text)
+    if match:
+        return _Field(match.group(2))
+    match = _CALL.match(text)
+    if match:
+        return _Call(match.group(1).lower(), [_parse_expression(part, values) for part in _split_top_level(match.group(2))])
+    try:
+        return float(text)
+    except ValueError:
+        raise ValueError(f"Unsupported expression in the local backend: {text}")
+
+
+def _vector_json_bytes(vector):
+    # The vector's size as JSON, measured on a prefix: serializing every component on each write
+    # is slow, and compact encodings (rounded floats, int8) are much shorter than full floats
+    if vector is None:
+        return 0
+    if isinstance(vector, np.ndarray) or not len(vector):
+        return VECTOR_JSON_BYTES_PER_FLOAT * len(vector)
+    prefix = vector[:VECTOR_SIZE_SAMPLE]
+    return int(len(json.dumps(prefix)) * len(vector) / len(prefix))
+
+
+def _keywords(arguments):
+    # Keywords may be passed one per argument or as one array
+    keywords = []
+    for argument in arguments:
+        keywords.extend(argument if isinstance(argument, list) else [argument])
+    return keywords
+
+
+class _VectorIndex:
+    """Unit-normalized float32 vectors in one contiguous matrix, plus the structure for the index type."""
+
+    def __init__(self, index_type, positions, vectors):
+        self.index_type = index_type
+        # Row r of the matrix holds the vector of document positions[r]
+        self.positions = np.asarray(positions, dtype=np.int64)
+        self.matrix = np.ascontiguousarray(_normalize_rows(np.asarray(vectors, dtype=np.float32)))
+        self.quantized = None
+        self.centroids = None
+        self.lists = None
+        if index_type == 'quantizedFlat' and len(self.matrix):
+            # Symmetric int8 quantization with one scale per dimension. Scoring uses the dequantized
+            # values, so results carry the quantization error while the scan runs at float32 BLAS speed
+            scale = np.abs(self.matrix).max(axis=0) / 127.0
+            scale[scale == 0] = 1.0
+            self.quantized = np.ascontiguousarray(np.round(self.matrix / scale).astype(np.int8) * scale, dtype=np.float32)
+        elif index_type == 'diskANN' and len(self.matrix) >= IVF_MIN_DOCUMENTS:
+            self._build_lists()
+
+    def _build_lists(self):
+        count = len(self.matrix)
+        list_count = max(1, int(np.sqrt(count)))
+        rng = np.random.default_rng(0)
+        self.centroids = self.matrix[rng.choice(count, list_count, replace=False)].copy()
+        for _ in range(IVF_KMEANS_ITERATIONS):
+            assignment = np.argmax(self.matrix @ self.centroids.T, axis=1)
+            for position in range(list_count):
+                members = self.matrix[assignment == position]
+                if len(members):
+                    self.centroids[position] = members.mean(axis=0)
+            self.centroids = _normalize_rows(self.centroids)
+        assignment = np.argmax(self.matrix @ self.centroids.T, axis=1)
+        self.lists = [np.flatnonzero(assignment == position) for position in range(list_count)]
+
+    def _scan_matrix(self):
+        return self.quantized if self.quantized is not None else self.matrix
+
+    @staticmethod
+    def _unit(query):
+        query = np.asarray(query, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        return query / norm if norm else query
+
+    def search(self, query, k, mask=None):
+        """Return (document positions, similarities, vectors scanned) for the k most similar vectors.
+
+        With a mask of allowed documents the search is an exact scan of those documents.
+        """
+        query = self._unit(query)
+        if mask is not None:
+            rows = np.flatnonzero(mask[self.positions])
+            scores = self._scan_matrix()[rows] @ query
+            order = _top_k(scores, k)
+            return self.positions[rows[order]], scores[order], len(rows)
+        if self.lists is not None:
+            probes = max(1, int(len(self.lists) * IVF_PROBE_FRACTION))
+            nearest = _top_k(self.centroids @ query, probes)
+            rows = np.concatenate([self.lists[position] for position in nearest])
+            scores = self.matrix[rows] @ query
+            order = _top_k(scores, k)
+            return self.positions[rows[order]], scores[order], len(rows) + len(self.centroids)
+        scores = self._scan_matrix() @ query
+        rows = _top_k(scores, k)
+        return self.positions[rows], scores[rows], len(scores)
+
+    def similarity(self, document_positions, query):
+        rows = np.searchsorted(self.positions, document_positions)
+        found = (rows < len(self.positions)) & (self.positions[np.minimum(rows, len(self.positions) - 1)] == document_positions)
+        similarities = np.full(len(document_positions), np.nan, dtype=np.float32)
+        similarities[found] = self._scan_matrix()[rows[found]] @ self._unit(query)
+        return similarities
+
+
+class _TextIndex:
+    """Posting lists of document positions and term frequencies for one text field."""
+
+    def __init__(self, texts):
+        positions = collections.defaultdict(list)
+        frequencies = collections.defaultdict(list)
+        self.lengths = np.zeros(len(texts), dtype=np.float32)
+        for position, text in enumerate(texts):
+            terms = collections.Counter(tokenize(text))
+            self.lengths[position] = sum(terms.values())
+            for term, count in terms.items():
+                positions[term].append(position)
+                frequencies[term].append(count)
+        self.postings = {
+            term: (np.array(positions[term], dtype=np.int64), np.array(frequencies[term], dtype=np.float32))
+            for term in positions
+        }
+        self.count = len(texts)
+        self.average_length = float(self.lengths.mean()) if len(texts) and self.lengths.mean() else 1.0
+
+    def _postings(self, term):
+        return self.postings.get(term, (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)))
+
+    def matches(self, keywords, match_all):
+        """A mask of documents containing all (or any) of the keywords, and the postings read.
+
+        A keyword that splits into several words matches documents containing all of them.
+        """
+        mask = np.full(self.count, match_all)
+        read = 0
+        for keyword in keywords:
+            keyword_mask = np.ones(self.count, dtype=bool)
+            for term in tokenize(keyword):
+                positions, _ = self._postings(term)
+                read += len(positions)
+                term_mask = np.zeros(self.count, dtype=bool)
+                term_mask[positions] = True
+                keyword_mask &= term_mask
+            mask = mask & keyword_mask if match_all else mask | keyword_mask
+        return mask, read
+
+    def scores(self, keywords):
+        """BM25 score of every document for the keywords, and the postings read."""
+        scores = np.zeros(self.count, dtype=np.float32)
+        read = 0
+        terms = list(dict.fromkeys(term for keyword in keywords for term in tokenize(keyword)))
+        for term in terms:
+            positions, frequencies = self._postings(term)
+            read += len(positions)
+            if not len(positions):
+                continue
+            idf = math.log(1 + (self.count - len(positions) + 0.5) / (len(positions) + 0.5))
+            norms = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[positions] / self.average_length)
+            scores[positions] += idf * frequencies * (BM25_K1 + 1) / (frequencies + norms)
+        return scores, read
+
+
+class _Snapshot:
+    """The documents of a container at one point in time, with indexes built on first use."""
+
+    def __init__(self, container, documents, vectors):
+        self.container = container
+        self.documents = documents
+        self.vectors = vectors
+        self._vector_index = None
+        self._text_indexes = {}
+        self._lock = threading.Lock()
+
+    def vector_index(self, field):
+        if field != self.container.vector_field:
+            raise ValueError(f"{self.container.id} has no vector policy for /{field}")
+        with self._lock:
+            if self._vector_index is None:
+                positions = [position for position, vector in enumerate(self.vectors) if vector is not None]
+                vectors = [self.vectors[position] for position in positions]
+                dimensions = self.container.dimensions
+                self._vector_index = _VectorIndex(
+                    self.container.index_type, positions,
+                    np.stack(vectors) if vectors else np.empty((0, dimensions), dtype=np.float32))
+            return self._vector_index
+
+    def text_index(self, field):
+        with self._lock:
+            if field not in self._text_indexes:
+                self._text_indexes[field] = _TextIndex([document.get(field) for document in self.documents])
+            return self._text_indexes[field]
+
+
+class _Execution:
+    """Evaluates one parsed query against a snapshot and keeps count of what it read."""
+
+    def __init__(self, container, snapshot):
+        self.container = container
+        self.snapshot = snapshot
+        self.charge = BASE_QUERY_CHARGE
+        self.retrieved = 0
+
+    def _read_vectors(self, count):
+        self.charge += CHARGE_PER_VECTOR_SCANNED[self.container.index_type] * count
+        self.retrieved += count
+
+    def _read_text(self, field, postings):
+        if field in self.container.full_text_fields:
+            self.charge += CHARGE_PER_POSTING * postings
+        else:
+            self.charge += CHARGE_PER_TEXT_SCANNED * len(self.snapshot.documents)
+            self.retrieved += len(self.snapshot.documents)
+
+    def filter(self, expression):
+        if not isinstance(expression, _Call) or expression.function not in ("fulltextcontainsall", "fulltextcontainsany"):
+            raise ValueError("The local backend only supports FullTextContainsAll and FullTextContainsAny filters")
+        field = expression.arguments[0].name
+        mask, read = self.snapshot.text_index(field).matches(
+            _keywords(expression.arguments[1:]), expression.function == "fulltextcontainsall")
+        self._read_text(field, read)
+        return mask
+
+    def rank(self, expression, mask, depth):
+        """Positions of the best `depth` documents for an ORDER BY expression, best first."""
+        if not isinstance(expression, _Call):
+            raise ValueError("The local backend only orders by VectorDistance, FullTextScore or RRF")
+        if expression.function == "vectordistance":
+            index = self.snapshot.vector_index(expression.arguments[0].name)
+            positions, _, scanned = index.search(expression.arguments[1], depth, mask)
+            self._read_vectors(scanned)
+            return positions
+        if expression.function == "fulltextscore":
+            field = expression.arguments[0].name
+            scores, read = self.snapshot.text_index(field).scores(_keywords(expression.arguments[1:]))
+            self._read_text(field, read)
+            if mask is not None:
+                scores = np.where(mask, scores, 0)
+            matched = np.flatnonzero(scores > 0)
+            return matched[_top_k(scores[matched], depth)]
+        if expression.function == "rrf":
+            arms = [argument for argument in expression.arguments if isinstance(argument, _Call)]
+            weights = next((argument for argument in expression.arguments if isinstance(argument, list)), [1.0] * len(arms))
+            fused = np.zeros(len(self.snapshot.documents), dtype=np.float64)
+            candidates = max(RRF_CANDIDATES, depth)
+            for arm, weight in zip(arms, weights):
+                positions = self.rank(arm, mask, candidates)
+                fused[positions] += weight / (RRF_K + 1 + np.arange(len(positions)))
+            matched = np.flatnonzero(fused > 0)
+            return matched[_top_k(fused[matched], depth)]
+        raise ValueError(f"Unsupported ranking function in the local backend: {expression.function}")
+
+    def project(self, projection, positions, values):
+        if projection.strip() == "*":
+            return [self.container._full_document(self.snapshot, position) for position in positions]
+        columns = []
+        for part in _split_top_level(projection):
+            match = _ALIAS.match(part)
+            expression = _parse_expression(match.group(1) if match else part, values)
+            if isinstance(expression, _Field):
+                columns.append((match.group(2) if match else expression.name, expression, None))
+            elif isinstance(expression, _Call) and expression.function == "vectordistance":
+                index = self.snapshot.vector_index(expression.arguments[0].name)
+                similarities = index.similarity(np.asarray(positions, dtype=np.int64), expression.arguments[1])
+                columns.append((match.group(2) if match else "$1", expression, similarities))
+            elif isinstance(expression, _Call) and expression.function == "substring":
+                field, begin, length = expression.arguments
+                begin, length = int(begin), int(length)
+                texts = [self.snapshot.documents[position].get(field.name) for position in positions]
+                columns.append((match.group(2) if match else "$1", expression,
+                                [text[begin:begin + length] if isinstance(text, str) else None for text in texts]))
+            else:
+                raise ValueError(f"Unsupported projection in the local backend: {part}")
+
+        items = []
+        for row, position in enumerate(positions):
+            document = self.snapshot.documents[position]
+            item = {}
+            for name, expression, computed in columns:
+                if computed is not None:
+                    if computed[row] is not None:
+                        item[name] = computed[row] if isinstance(computed[row], str) else float(computed[row])
+                elif expression.name == self.container.vector_field and self.snapshot.vectors[position] is not None:
+                    item[name] = self.snapshot.vectors[position].tolist()
+                elif expression.name in document:
+                    item[name] = document[expression.name]
+            items.append(item)
+        return items
+
+
+class _ClientConnection:
+    def __init__(self):
+        self.last_response_headers = {}
+
+
+class _Store:
+    """Container definitions and documents in one SQLite file, shared between processes."""
+
+    def __init__(self, path):
+        # Each write request commits on its own, and in WAL mode readers never wait for it, so
+        # loader processes sharing the file only queue behind each other's single batch
+        self._connection = sqlite3.connect(path, check_same_thread=False, timeout=60)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._lock = threading.Lock()
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS containers ("
+                "database TEXT NOT NULL, name TEXT NOT NULL, definition TEXT NOT NULL, "
+                "PRIMARY KEY (database, name))")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS documents ("
+                "database TEXT NOT NULL, container TEXT NOT NULL, id TEXT NOT NULL, body TEXT NOT NULL, vector BLOB, "
+                "PRIMARY KEY (database, container, id))")
+
+    def data_version(self):
+        # Changes whenever another connection commits to the file
+        with self._lock:
+            return self._connection.execute("PRAGMA data_version").fetchone()[0]
+
+    def definition(self, database, name):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT definition FROM containers WHERE database = ? AND name = ?", (database, name)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_definition(self, database, name, definition):
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR IGNORE INTO containers (database, name, definition) VALUES (?, ?, ?)",
+                (database, name, json.dumps(definition)))
+
+    def documents(self, database, container):
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT body, vector FROM documents WHERE database = ? AND container = ? ORDER BY rowid",
+                (database, container)).fetchall()
+        return [(json.loads(body), None if vector is None else np.frombuffer(vector, dtype=np.float32))
+                for body, vector in rows]
+
+    def put(self, database, container, rows):
+        """Write (id, body, vector) rows in one transaction."""
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO documents (database, container, id, body, vector) VALUES (?, ?, ?, ?, ?)",
+                [(database, container, id, body, None if vector is None else vector.tobytes())
+                 for id, body, vector in rows])
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class LocalContainer:
+    """One container: documents by id, with indexes rebuilt lazily after writes."""
+
+    def __init__(self, database, name, definition, store=None):
+        self.database = database
+        self.id = name
+        self.definition = definition
+        self.index_type = None
+        for index in (definition.get("indexing_policy") or {}).get("vectorIndexes", []):
+            self.index_type = index["type"]
+        self.full_text_fields = {index["path"].strip("/") for index in (definition.get("indexing_policy") or {}).get("fullTextIndexes", [])}
+        embeddings = (definition.get("vector_embedding_policy") or {}).get("vectorEmbeddings") or [{"path": "/embedding", "dimensions": 1536}]
+        self.vector_field = embeddings[0]["path"].strip("/")
+        self.dimensions = embeddings[0].get("dimensions", 1536)
+        self.partition_key_path = definition.get("partition_key_path", "/id")
+        self.client_connection = _ClientConnection()
+        self._store = store
+        self._documents = {}
+        self._vectors = {}
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._store_version = None
+        if store is not None:
+            self._load()
+
+    def _load(self):
+        self._store_version = self._store.data_version()
+        self._documents = {}
+        self._vectors = {}
+        for document, vector in self._store.documents(self.database, self.id):
+            self._documents[document["id"]] = document
+            self._vectors[document["id"]] = vector
+
+    def _split(self, body):
+        # Vectors are kept as float32 arrays next to the rest of the document
+        document = dict(body)
+        vector = document.pop(self.vector_field, None)
+        if vector is not None:
+            vector = np.asarray(vector, dtype=np.float32)
+        return document, vector
+
+    def _write(self, bodies):
+        """Store the documents of one request, committed together; returns its charge."""
+        rows = []
+        charge = 0.0
+        for body in bodies:
+            vector_bytes = _vector_json_bytes(body.get(self.vector_field))
+            document, vector = self._split(body)
+            serialized = json.dumps(document)
+            rows.append((document, serialized, vector))
+            charge += WRITE_BASE_CHARGE + WRITE_CHARGE_PER_KB * (len(serialized) + vector_bytes) / 1024
+        with self._lock:
+            if self._store is not None:
+                self._store.put(self.database, self.id, [(document["id"], serialized, vector)
+                                                         for document, serialized, vector in rows])
+            for document, serialized, vector in rows:
+                self._documents[document["id"]] = document
+                self._vectors[document["id"]] = vector
+            self._snapshot = None
+        return charge
+
+    def _write_headers(self, charge):
+        headers = {"x-ms-request-charge": f"{charge:.2f}"}
+        self.client_connection.last_response_headers = headers
+        return headers
+
+    def upsert_item(self, body, response_hook=None, **kwargs):
+        headers = self._write_headers(self._write([body]))
+        if response_hook:
+            response_hook(headers, body)
+        return body
+
+    def execute_item_batch(self, batch_operations, partition_key=None, response_hook=None, **kwargs):
+        for operation, arguments in batch_operations:
+            if operation not in ("upsert", "create"):
+                raise ValueError(f"The local backend does not support {operation} in a batch")
+        bodies = [arguments[0] for operation, arguments in batch_operations]
+        headers = self._write_headers(self._write(bodies))
+        results = [{"statusCode": 200, "resourceBody": body} for body in bodies]
+        if response_hook:
+            response_hook(headers, results)
+        return results
+
+    def read(self, **kwargs):
+        return {"id": self.id, "partitionKey": {"paths": [self.partition_key_path], "kind": "Hash"}}
+
+    def get_throughput(self, **kwargs):
+        return _Throughput(self.definition.get("offer_throughput"))
+
+    def read_all_items(self, **kwargs):
+        snapshot = self._current_snapshot()
+        return iter([self._full_document(snapshot, position) for position in range(len(snapshot.documents))])
+
+    def _full_document(self, snapshot, position):
+        document = dict(snapshot.documents[position])
+        if snapshot.vectors[position] is not None:
+            document[self.vector_field] = snapshot.vectors[position].tolist()
+        return document
+
+    def _current_snapshot(self):
+        # Queries see the documents as of the last write, including writes from other processes
+        # sharing the store; indexes are rebuilt at most once per batch of writes
+        with self._lock:
+            if self._store is not None and self._store.data_version() != self._store_version:
+                self._load()
+                self._snapshot = None
+            if self._snapshot is None:
+                self._snapshot = _Snapshot(self, list(self._documents.values()),
+                                           [self._vectors[document["id"]] for document in self._documents.values()])
+            return self._snapshot
+
+    def query_items(self, query, parameters=None, response_hook=None, max_item_count=None, **kwargs):
+        values = {parameter["name"]: parameter["value"] for parameter in parameters or []}
+        match = _QUERY.match(query)
+        if not match:
+            raise ValueError(f"Unsupported query in the local backend: {query}")
+        return _ItemPaged(self, match.groups(), values, response_hook, max_item_count)
+
+    def _execute(self, groups, values):
+        top, projection, _, where, order_by = groups
+        snapshot = self._current_snapshot()
+        execution = _Execution(self, snapshot)
+        count = len(snapshot.documents)
+        depth = int(_parse_expression(top, values)) if top else count
+
+        start = time.perf_counter()
+        mask = execution.filter(_parse_expression(where, values)) if where else None
+        if order_by:
+            positions = execution.rank(_parse_expression(order_by, values), mask, depth)
+        else:
+            positions = (np.flatnonzero(mask) if mask is not None else np.arange(count))[:depth]
+        loaded = time.perf_counter()
+        items = execution.project(projection, positions, values)
+        # Reported as the index lookup and document load parts of the query metrics
+        execution.lookup_ms = (loaded - start) * 1000
+        execution.load_ms = (time.perf_counter() - loaded) * 1000
+        return execution, items
+
+
+class _ItemPaged:
+    """The local counterpart of the SDK's ItemPaged: iterates over items, or over pages with by_page.
+
+    The query runs when the first page is fetched. Each page is answered with its own headers,
+    passed to the response hook, and the continuation token is the offset of the next page.
+    """
+
+    def __init__(self, container, groups, values, response_hook, max_item_count):
+        self.container = container
+        self.groups = groups
+        self.values = values
+        self.response_hook = response_hook
+        self.max_item_count = max_item_count
+        self._items = None
+
+    def __iter__(self):
+        for page in self.by_page():
+            yield from page
+
+    def by_page(self, continuation_token=None):
+        return _PageIterator(self, continuation_token)
+
+    def _fetch(self, continuation_token):
+        start = time.perf_counter()
+        charge = 0.0
+        retrieved = 0
+        lookup_ms = load_ms = 0.0
+        if self._items is None:
+            # The first page fetched pays for running the query; later pages only for their results
+            execution, self._items = self.container._execute(self.groups, self.values)
+            charge, retrieved = execution.charge, execution.retrieved
+            lookup_ms, load_ms = execution.lookup_ms, execution.load_ms
+        offset = int(continuation_token or 0)
+        end = len(self._items) if not self.max_item_count else offset + self.max_item_count
+        items = self._items[offset:end]
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        headers = {
+            "x-ms-request-charge": f"{charge + CHARGE_PER_RESULT * len(items):.2f}",
+            "x-ms-documentdb-query-metrics": (
+                f"totalExecutionTimeInMs={elapsed_ms:.2f};indexLookupTimeInMs={lookup_ms:.2f};"
+                f"documentLoadTimeInMs={load_ms:.2f};retrievedDocumentCount={retrieved};"
+                f"outputDocumentCount={len(items)}"),
+        }
+        if end < len(self._items):
+            headers["x-ms-continuation"] = str(end)
+        self.container.client_connection.last_response_headers = headers
+        if self.response_hook:
+            self.response_hook(headers, {"Documents": items})
+        return items, headers.get("x-ms-continuation")
+
+
+class _PageIterator:
+    def __init__(self, paged, continuation_token):
+        self._paged = paged
+        self.continuation_token = continuation_token
+        self._done = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._done:
+            raise StopIteration
+        items, self.continuation_token = self._paged._fetch(self.continuation_token)
+        self._done = self.continuation_token is None
+        return iter(items)
+
+
+class _Throughput:
+    def __init__(self, offer_throughput):
+        self.offer_throughput = offer_throughput or 10000
+        self.auto_scale_max_throughput = None
+
+
+class LocalDatabase:
+    def __init__(self, name, store=None):
+        self.id = name
+        self._store = store
+        self._containers = {}
+        self._lock = threading.Lock()
+
+    def create_container_if_not_exists(self, id, partition_key=None, indexing_policy=None,
+                                       vector_embedding_policy=None, full_text_policy=None,
+                                       offer_throughput=None, **kwargs):
+        definition = {
+            "partition_key_path": partition_key["paths"][0] if partition_key else "/id",
+            "indexing_policy": indexing_policy,
+            "vector_embedding_policy": vector_embedding_policy,
+            "full_text_policy": full_text_policy,
+            "offer_throughput": offer_throughput,
+        }
+        if self._store is not None:
+            self._store.save_definition(self.id, id, definition)
+        with self._lock:
+            if id not in self._containers:
+                self._containers[id] = LocalContainer(self.id, id, definition, self._store)
+            return self._containers[id]
+
+    def get_container_client(self, name):
+        with self._lock:
+            if name not in self._containers:
+                definition = self._store.definition(self.id, name) if self._store is not None else None
+                self._containers[name] = LocalContainer(self.id, name, definition or {}, self._store)
+            return self._containers[name]
+
+
+class LocalCosmosClient:
+    """Stands in for azure.cosmos.CosmosClient.
+
+    Without a path, databases live only as long as the client; with one they are kept in that
+    SQLite file.
+    """
+
+    def __init__(self, path=None):
+        self._store = _Store(path) if path else None
+        self._databases = {}
+        self._lock = threading.Lock()
+
+    def create_database_if_not_exists(self, id, **kwargs):
+        return self.get_database_client(id)
+
+    def get_database_client(self, name):
+        with self._lock:
+            if name not in self._databases:
+                self._databases[name] = LocalDatabase(name, self._store)
+            return self._databases[name]
+
+    def close(self):
+        if self._store is not None:
+            self._store.close()
+            self._store = None
+
+
+class _AsyncLocalContainer:
+    def __init__(self, container):
+        self._container = container
+        self.id = container.id
+
+    # Writes wait on SQLite, possibly behind another loader process, so they run off the event loop
+    async def upsert_item(self, body, **kwargs):
+        return await asyncio.to_thread(self._container.upsert_item, body, **kwargs)
+
+    async def execute_item_batch(self, batch_operations, partition_key=None, **kwargs):
+        return await asyncio.to_thread(self._container.execute_item_batch, batch_operations, partition_key, **kwargs)
+
+    async def read(self, **kwargs):
+        return self._container.read()
+
+    async def get_throughput(self, **kwargs):
+        return self._container.get_throughput()
+
+
+class _AsyncLocalDatabase:
+    def __init__(self, database):
+        self._database = database
+        self.id = database.id
+
+    def get_container_client(self, name):
+        return _AsyncLocalContainer(self._database.get_container_client(name))
+
+
+class AsyncLocalCosmosClient:
+    """Stands in for azure.cosmos.aio.CosmosClient, on top of a LocalCosmosClient."""
+
+    def __init__(self, path=None):
+        self.client = LocalCosmosClient(path)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.client.close()
+        return False
+
+    def get_database_client(self, name):
+        return _AsyncLocalDatabase(self.client.get_database_client(name))
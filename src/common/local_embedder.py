@@ -0,0 +1,155 @@
+import asyncio
+import concurrent.futures
+import functools
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+from common.embedding_decode import embedding_response
+
+# A query-side (and optionally ingest-side) embedding model that runs on the CPU in this process,
+# in place of a round trip to Azure OpenAI. It is a sentence-transformers model, run with torch
+# or, with LOCAL_EMBEDDING_RUNTIME=onnx, with ONNX Runtime; sentence-transformers is only needed
+# when EMBEDDING_BACKEND=local:
+#
+# pip install sentence-transformers            # torch
+# pip install "sentence-transformers[onnx]"    # ONNX Runtime
+#
+# The model is loaded once per process. Concurrent requests, from app sessions or loader tasks,
+# are gathered into micro-batches: the first request waits up to max_wait_ms for others to join
+# it, so the model runs one forward pass for the batch rather than one per request.
+
+DEFAULT_LOCAL_EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+DEFAULT_MAX_BATCH_SIZE = 32
+DEFAULT_MAX_WAIT_MS = 5
+
+
+def local_embedding_model():
+    return os.getenv("LOCAL_EMBEDDING_MODEL", DEFAULT_LOCAL_EMBEDDING_MODEL)
+
+
+def local_embedding_runtime():
+    return os.getenv("LOCAL_EMBEDDING_RUNTIME", "torch")
+
+
+def load_model(model_name, runtime="torch"):
+    try:
+        from sentence_transformers import SentenceTransformer
+    except ImportError:
+        raise ImportError("EMBEDDING_BACKEND=local needs sentence-transformers: pip install sentence-transformers")
+    print(f"Loading {model_name} with {runtime}")
+    start = time.perf_counter()
+    model = SentenceTransformer(model_name, device="cpu", backend=runtime)
+    print(f"Loaded {model_name} in {time.perf_counter() - start:.2f} seconds")
+    return model
+
+
+class LocalEmbedder:
+    """A sentence-transformers model behind a micro-batching queue, returning unit float32 vectors.
+
+    With dimensions below the model's own, vectors are truncated to their leading components and
+    renormalized, so they fit a container created for that many dimensions.
+    """
+
+    def __init__(self, model, dimensions=None, max_batch_size=DEFAULT_MAX_BATCH_SIZE, max_wait_ms=DEFAULT_MAX_WAIT_MS):
+        self.model = model
+        model_dimensions = model.get_sentence_embedding_dimension()
+        self.dimensions = dimensions or model_dimensions
+        if self.dimensions > model_dimensions:
+            raise ValueError(f"The local embedding model returns {model_dimensions} dimensions, fewer than the {self.dimensions} configured")
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.batches = 0
+        self.texts = 0
+        self._requests = queue.Queue()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def submit(self, texts):
+        """Queue texts for embedding; the returned future resolves to one row per text."""
+        future = concurrent.futures.Future()
+        self._requests.put((list(texts), future))
+        return future
+
+    def embed(self, texts):
+        return self.submit(texts).result()
+
+    def _run(self):
+        while True:
+            requests = [self._requests.get()]
+            size = len(requests[0][0])
+            deadline = time.monotonic() + self.max_wait
+            while size < self.max_batch_size:
+                try:
+                    request = self._requests.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                requests.append(request)
+                size += len(request[0])
+            # Requests whose caller has given up (an interrupted load, a Streamlit rerun) are dropped;
+            # the rest are marked running, so they can no longer be cancelled under the thread
+            requests = [request for request in requests if request[1].set_running_or_notify_cancel()]
+            if requests:
+                self._complete(requests)
+
+    def _complete(self, requests):
+        texts = [text for request_texts, _ in requests for text in request_texts]
+        try:
+            vectors = self._encode(texts)
+        except Exception as e:
+            if len(requests) == 1:
+                requests[0][1].set_exception(e)
+                return
+            # One bad request fails the whole batch, so run each on its own and fail only that one
+            for request in requests:
+                self._complete([request])
+            return
+        self.batches += 1
+        self.texts += len(texts)
+        start = 0
+        for request_texts, future in requests:
+            future.set_result(vectors[start:start + len(request_texts)])
+            start += len(request_texts)
+
+    def _encode(self, texts):
+        vectors = self.model.encode(texts, batch_size=self.max_batch_size, convert_to_numpy=True)
+        vectors = np.ascontiguousarray(vectors[:, :self.dimensions], dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+
+@functools.lru_cache(maxsize=None)
+def shared_local_embedder(model_name, runtime, dimensions):
+    # One model per process, however many clients are created; dimensions None keeps the model's own
+    return LocalEmbedder(load_model(model_name, runtime), dimensions)
+
+
+class LocalEmbeddingsClient:
+    """Stands in for AzureOpenAI's embeddings API, answering with a LocalEmbedder."""
+
+    def __init__(self, embedder, model_name):
+        self.embedder = embedder
+        self.model_name = model_name
+        self.embeddings = self
+
+    def create(self, input, model=None, encoding_format=None, **kwargs):
+        texts = [input] if isinstance(input, str) else input
+        return embedding_response(self.embedder.embed(texts), self.model_name, encoding_format)
+
+
+class AsyncLocalEmbeddingsClient(LocalEmbeddingsClient):
+    """Stands in for AsyncAzureOpenAI's embeddings API; concurrent calls share micro-batches."""
+
+    async def create(self, input, model=None, encoding_format=None, **kwargs):
+        texts = [input] if isinstance(input, str) else input
+        vectors = await asyncio.wrap_future(self.embedder.submit(texts))
+        return embedding_response(vectors, self.model_name, encoding_format)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
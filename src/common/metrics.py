@@ -0,0 +1,182 @@
+import bisect
+import collections
+import contextlib
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds of the cumulative histogram buckets, in the unit of each metric (seconds for spans)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# For milliseconds, counts and request charges
+WIDE_BUCKETS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+# Quantiles reported over the most recent observations
+DEFAULT_QUANTILES = (0.5, 0.95, 0.99)
+DEFAULT_WINDOW = 1024
+
+
+def parse_query_metrics(header):
+    """Every field of an x-ms-documentdb-query-metrics header, as floats by name.
+
+    The header is a semicolon-separated list of name=value pairs, for example
+    totalExecutionTimeInMs, queryCompileTimeInMs, indexLookupTimeInMs, retrievedDocumentCount,
+    VMExecutionTimeInMs and documentLoadTimeInMs. Fields that are not numbers are skipped.
+    """
+    metrics = {}
+    for part in (header or "").split(";"):
+        name, _, value = part.partition("=")
+        try:
+            metrics[name.strip()] = float(value)
+        except ValueError:
+            continue
+    return metrics
+
+
+class Histogram:
+    """Cumulative bucket counts since start, plus the last window observations for rolling quantiles."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, window=DEFAULT_WINDOW):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = collections.deque(maxlen=window)
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+
+    def quantiles(self, quantiles=DEFAULT_QUANTILES):
+        recent = sorted(self.recent)
+        if not recent:
+            return {quantile: 0.0 for quantile in quantiles}
+        return {quantile: recent[min(len(recent) - 1, int(quantile * len(recent)))] for quantile in quantiles}
+
+
+class MetricsRegistry:
+    """Histograms by metric name and labels, recorded from any thread and exported as JSON or Prometheus text.
+
+    Spans are timed with span(), which records the elapsed seconds under the span's name;
+    other values, like the fields of a query-metrics header, are recorded with observe().
+    """
+
+    def __init__(self, prefix="search", buckets=DEFAULT_BUCKETS, window=DEFAULT_WINDOW):
+        self.prefix = prefix
+        self.buckets = buckets
+        self.window = window
+        self._histograms = {}
+        self._help = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, value, description=None, buckets=None, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets or self.buckets, self.window)
+            if description:
+                self._help[name] = description
+            histogram.observe(value)
+
+    @contextlib.contextmanager
+    def span(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(f"{name}_seconds", time.perf_counter() - start, **labels)
+
+    def observe_query_metrics(self, header, **labels):
+        """Record every field of a query-metrics header, one series per field."""
+        for field, value in parse_query_metrics(header).items():
+            self.observe("query_metric", value, "Fields of x-ms-documentdb-query-metrics, per page",
+                         WIDE_BUCKETS, field=field, **labels)
+
+    def snapshot(self):
+        """One row per series: name, labels, count, sum and rolling quantiles."""
+        with self._lock:
+            return [{
+                "name": name,
+                "labels": dict(labels),
+                "count": histogram.count,
+                "sum": histogram.sum,
+                "quantiles": {str(quantile): value for quantile, value in histogram.quantiles().items()},
+            } for (name, labels), histogram in sorted(self._histograms.items())]
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self):
+        """The text exposition format: each series as a histogram, and its rolling quantiles as a summary."""
+        lines = []
+        with self._lock:
+            by_name = collections.defaultdict(list)
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                by_name[name].append((labels, histogram))
+            for name, series in by_name.items():
+                metric = f"{self.prefix}_{name}"
+                if name in self._help:
+                    lines.append(f"# HELP {metric} {self._help[name]}")
+                lines.append(f"# TYPE {metric} histogram")
+                for labels, histogram in series:
+                    cumulative = 0
+                    for bound, count in zip(list(histogram.buckets) + ["+Inf"], histogram.counts):
+                        cumulative += count
+                        lines.append(f"{metric}_bucket{_labels(labels, le=bound)} {cumulative}")
+                    lines.append(f"{metric}_sum{_labels(labels)} {histogram.sum}")
+                    lines.append(f"{metric}_count{_labels(labels)} {histogram.count}")
+                lines.append(f"# TYPE {metric}_recent summary")
+                for labels, histogram in series:
+                    for quantile, value in histogram.quantiles().items():
+                        lines.append(f"{metric}_recent{_labels(labels, quantile=quantile)} {value}")
+                    lines.append(f"{metric}_recent_sum{_labels(labels)} {sum(histogram.recent)}")
+                    lines.append(f"{metric}_recent_count{_labels(labels)} {len(histogram.recent)}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def serve_metrics(registry, port, address=""):
+    """Serve /metrics (Prometheus text) and /metrics.json from a background thread; returns the server."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/metrics":
+                body, content_type = registry.to_prometheus(), "text/plain; version=0.0.4"
+            elif self.path == "/metrics.json":
+                body, content_type = registry.to_json(), "application/json"
+            else:
+                self.send_error(404)
+                return
+            body = body.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((address, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Serving metrics on port {server.server_address[1]}")
+    return server
+
+
+def metrics_from_env():
+    """A registry, served over HTTP on METRICS_PORT when that is set."""
+    registry = MetricsRegistry()
+    port = os.getenv("METRICS_PORT")
+    if port:
+        serve_metrics(registry, int(port))
+    return registry
@@ -0,0 +1,144 @@
+import argparse
+import os
+import sys
+import time
+
+from azure.cosmos import CosmosClient, PartitionKey
+from dotenv import load_dotenv
+
+# Also run as a script, from anywhere
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from common.vector_transform import transform_from_env
+
+# Schema for the demo database: three containers that differ only in their vector index.
+# The app runs this once per process at startup; it can also be run ahead of a deployment.
+#
+# how to call:
+# python src/common/provisioning.py --database_name "ignite2024demo"
+
+DATABASE_NAME = 'ignite2024demo'
+CONTAINER_THROUGHPUT = 10000
+
+# Define the vector property and dimensions
+cosmos_vector_property = "embedding"
+cosmos_full_text_property = "text"
+openai_embeddings_dimensions = 1536
+
+# policies and indexes
+full_text_policy = {
+    "defaultLanguage": "en-US",
+    "fullTextPaths": [
+        {
+            "path": "/" + cosmos_full_text_property,
+            "language": "en-US",
+        }
+    ]
+}
+
+
+def configured_dimensions():
+    value = os.getenv("EMBEDDING_DIMENSIONS")
+    return int(value) if value else None
+
+
+def embedding_dimensions(backend=None):
+    # EMBEDDING_DIMENSIONS must match the embedder's output; unset, it is the embedder's own size,
+    # which for a local model means loading it
+    dimensions = configured_dimensions()
+    if dimensions is None and (backend or os.getenv("EMBEDDING_BACKEND")) == "local":
+        from common.local_embedder import local_embedding_model, local_embedding_runtime, shared_local_embedder
+        return shared_local_embedder(local_embedding_model(), local_embedding_runtime(), None).dimensions
+    return dimensions or openai_embeddings_dimensions
+
+
+def vector_embedding_policy(dimensions=None, data_type="float32"):
+    return {
+        "vectorEmbeddings": [
+            {
+                "path": "/" + cosmos_vector_property,
+                "dataType": data_type,
+                "distanceFunction": "cosine",
+                "dimensions": dimensions or embedding_dimensions()
+            },
+        ]
+    }
+
+
+def vector_indexing_policy(index_type):
+    return {
+        "includedPaths": [
+            {"path": "/*"}
+        ],
+        "excludedPaths": [
+            {"path": "/\"_etag\"/?"}
+        ],
+        "vectorIndexes": [
+            {
+                "path": "/" + cosmos_vector_property,
+                "type": index_type,
+            }
+        ],
+        "fullTextIndexes": [
+            {
+                "path": "/" + cosmos_full_text_property
+            }
+        ]
+    }
+
+
+qflat_indexing_policy = vector_indexing_policy("quantizedFlat")
+diskann_indexing_policy = vector_indexing_policy("diskANN")
+
+# Container name and indexing policy; None keeps the default policy, with no vector index
+CONTAINERS = {
+    'search': None,
+    'search_qflat': qflat_indexing_policy,
+    'search_diskann': diskann_indexing_policy,
+}
+
+
+def transform_policy(transform, dimensions=None):
+    """provision() options for containers holding vectors compacted by a VectorTransform, if any."""
+    dimensions = dimensions or embedding_dimensions()
+    if transform is None:
+        return {"dimensions": dimensions}
+    return {"dimensions": transform.output_dimensions(dimensions), "data_type": transform.data_type}
+
+
+def provision(client, database_name=DATABASE_NAME, throughput=CONTAINER_THROUGHPUT, dimensions=None, data_type="float32"):
+    """Create the database and containers if they do not exist and return the database client.
+
+    Containers that already exist keep the vector dimensions and data type they were created with.
+    """
+    start = time.perf_counter()
+    database = client.create_database_if_not_exists(database_name)
+    for container_name, indexing_policy in CONTAINERS.items():
+        options = {"indexing_policy": indexing_policy} if indexing_policy else {}
+        database.create_container_if_not_exists(
+            id=container_name,
+            partition_key=PartitionKey(path="/id"),
+            full_text_policy=full_text_policy,
+            vector_embedding_policy=vector_embedding_policy(dimensions, data_type),
+            offer_throughput=throughput,
+            **options
+        )
+    print(f"Provisioned {database_name} with {len(CONTAINERS)} containers in {time.perf_counter() - start:.2f} seconds.")
+    return database
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Create the demo database and containers.')
+    parser.add_argument('--database_name', type=str, default=DATABASE_NAME, help='Database to create.')
+    parser.add_argument('--throughput', type=int, default=CONTAINER_THROUGHPUT, help='RU/s provisioned for each new container.')
+    parser.add_argument('--dimensions', type=int, help='Vector dimensions of new containers (defaults to EMBEDDING_DIMENSIONS or 1536).')
+    parser.add_argument('--vector_transform', help='Size the vector policy for documents compacted with this transform (defaults to VECTOR_TRANSFORM_PATH).')
+    args = parser.parse_args()
+
+    load_dotenv()
+    client = CosmosClient(os.getenv("AZURE_COSMOSDB_ENDPOINT"), credential=os.getenv("AZURE_COSMOSDB_KEY"))
+    provision(client, args.database_name, args.throughput, **transform_policy(transform_from_env(args.vector_transform), args.dimensions))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# Query builders for the search handlers. The query vector and the keywords are sent as
+# @parameters rather than pasted into the SQL text, so a 1536-dimension vector is not rendered
+# into the query twice, keywords never need quoting, and the query text stays the same from
+# one search to the next.
+
+import textwrap
+
+DEFAULT_TOP_K = 10
+# Characters of each result's text returned as its snippet; None returns the full text
+DEFAULT_SNIPPET_LENGTH = 200
+
+
+def query_keywords(text):
+    """Split search text into keywords, dropping repeats but keeping their order."""
+    keywords = []
+    for keyword in text.split():
+        if keyword not in keywords:
+            keywords.append(keyword)
+    return keywords
+
+
+def _keyword_parameters(keywords):
+    names = [f"@k{position}" for position in range(len(keywords))]
+    parameters = [{"name": name, "value": keyword} for name, keyword in zip(names, keywords)]
+    return ", ".join(names), parameters
+
+
+def _top(top_k):
+    # TOP stays inline so the value is always a plain integer in the query text
+    return int(top_k)
+
+
+def _columns(snippet_length):
+    # Results carry a snippet of the text rather than all of it, which the service cuts server-side
+    if snippet_length is None:
+        return "l.id, l.title, l.text"
+    return f"l.id, l.title, SUBSTRING(l.text, 0, {int(snippet_length)}) AS snippet"
+
+
+def vector_search_query(vector, top_k=DEFAULT_TOP_K, snippet_length=DEFAULT_SNIPPET_LENGTH):
+    query = f'''
+    SELECT TOP {_top(top_k)} {_columns(snippet_length)}, VectorDistance(l.embedding, @embedding) as SimilarityScore
+    FROM l
+    ORDER BY VectorDistance(l.embedding, @embedding)
+    '''
+    return query, [{"name": "@embedding", "value": vector}]
+
+
+def full_text_search_query(keywords, top_k=DEFAULT_TOP_K, match_all=True, snippet_length=DEFAULT_SNIPPET_LENGTH):
+    names, parameters = _keyword_parameters(keywords)
+    function = "FullTextContainsAll" if match_all else "FullTextContainsAny"
+    query = f'''
+    SELECT TOP {_top(top_k)} {_columns(snippet_length)}
+    FROM l
+    WHERE {function}(l.text, {names})
+    '''
+    return query, parameters
+
+
+def full_text_ranking_query(keywords, top_k=DEFAULT_TOP_K, snippet_length=DEFAULT_SNIPPET_LENGTH):
+    names, parameters = _keyword_parameters(keywords)
+    query = f'''
+    SELECT TOP {_top(top_k)} {_columns(snippet_length)}
+    FROM l
+    ORDER BY RANK FullTextScore(l.text, [{names}])
+    '''
+    return query, parameters
+
+
+def hybrid_ranking_query(keywords, vector, top_k=DEFAULT_TOP_K, snippet_length=DEFAULT_SNIPPET_LENGTH):
+    names, parameters = _keyword_parameters(keywords)
+    query = f'''
+    SELECT TOP {_top(top_k)} {_columns(snippet_length)}
+    FROM l
+    ORDER BY RANK RRF(FullTextScore(l.text, [{names}]), VectorDistance(l.embedding, @embedding))
+    '''
+    return query, parameters + [{"name": "@embedding", "value": vector}]
+
+
+def describe_query(query, parameters):
+    """The query text followed by its parameters, with vectors shown by length only."""
+    described = []
+    for parameter in parameters:
+        value = parameter["value"]
+        if isinstance(value, (list, tuple)) and len(value) > 8:
+            value = f"<{len(value)} floats>"
+        else:
+            value = repr(value)
+        described.append(f"{parameter['name']} = {value}")
+    return textwrap.dedent(query).strip() + ("\n" + "\n".join(described) if described else "")
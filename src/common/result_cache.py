@@ -0,0 +1,165 @@
+import collections
+import contextlib
+import copy
+import json
+import os
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, where bumps from concurrent processes are not serialized
+    fcntl = None
+
+from common.embedding_cache import normalize_text
+
+DEFAULT_TTL_SECONDS = 300
+DEFAULT_MAX_ENTRIES = 256
+DEFAULT_VERSIONS_PATH = "result-cache-versions.json"
+
+
+@contextlib.contextmanager
+def _file_lock(path):
+    # Held across a read-modify-write of the versions file, which loader workers bump concurrently
+    with open(f"{path}.lock", "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+
+class CacheVersions:
+    """A version number per container, kept in a small JSON file shared by the loader and the app.
+
+    The loader bumps a container's version whenever it commits writes to it. Cached results
+    remember the version they were computed at, so they stop being served once it changes.
+    """
+
+    def __init__(self, path=DEFAULT_VERSIONS_PATH, database_name="ignite2024demo"):
+        self.path = path
+        self.database_name = database_name
+        self._lock = threading.Lock()
+        self._loaded_mtime = None
+        self._versions = {}
+
+    def _key(self, container_name):
+        return f"{self.database_name}/{container_name}"
+
+    def _read(self):
+        try:
+            with open(self.path, encoding="utf-8") as file:
+                return json.load(file)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def get(self, container_name):
+        with self._lock:
+            # Re-read only when another process has replaced the file
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except FileNotFoundError:
+                mtime = None
+            if mtime != self._loaded_mtime:
+                self._versions = self._read()
+                self._loaded_mtime = mtime
+            return self._versions.get(self._key(container_name), 0)
+
+    def bump(self, container_names):
+        with self._lock, _file_lock(self.path):
+            versions = self._read()
+            for name in container_names:
+                versions[self._key(name)] = versions.get(self._key(name), 0) + 1
+            # Write and rename so a reader never sees a half-written file; the temporary file is
+            # unique to this write, next to the target so the rename stays on one file system
+            descriptor, temporary_path = tempfile.mkstemp(
+                prefix=f"{os.path.basename(self.path)}.", suffix=".tmp", dir=os.path.dirname(os.path.abspath(self.path)))
+            try:
+                with os.fdopen(descriptor, "w", encoding="utf-8") as file:
+                    json.dump(versions, file)
+                os.replace(temporary_path, self.path)
+            except BaseException:
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(temporary_path)
+                raise
+
+
+def result_key(mode, container_name, text, top_k, options=None):
+    """Results depend on the search mode, the container, the query text and k, plus any mode options."""
+    return (mode, container_name, normalize_text(text), top_k, tuple(sorted((options or {}).items())))
+
+
+class ResultCache:
+    """Search results by result_key, expiring after ttl seconds and evicting the least recently used.
+
+    An entry is also dropped when its container's version has changed since it was stored. Hits
+    are returned as copies marked cached, and the request charge they avoided is counted as saved.
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL_SECONDS, max_entries=DEFAULT_MAX_ENTRIES, versions=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.versions = versions
+        self.hits = 0
+        self.misses = 0
+        self.ru_saved = 0.0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def version(self, key):
+        """The key's container version; read it before querying and pass it to put."""
+        return self.versions.get(key[1]) if self.versions is not None else 0
+
+    def get(self, key):
+        version = self.version(key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, entry_version, result = entry
+                if expires_at > time.monotonic() and entry_version == version:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    self.ru_saved += result.request_charge
+                    hit = copy.copy(result)
+                    hit.cached = True
+                    return hit
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, result, version):
+        """Store a result under the container version read before it was queried.
+
+        A write committed while the query ran then bumps the version past the entry's, so a
+        result from before the write is not served as current.
+        """
+        if result.error is not None or self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, version, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "ru_saved": self.ru_saved,
+            "entries": len(self._entries),
+        }
+
+
+def result_cache_from_env(database_name="ignite2024demo"):
+    """Build the cache configured by RESULT_CACHE_TTL, RESULT_CACHE_ENTRIES and RESULT_CACHE_VERSIONS_PATH.
+
+    A TTL of 0 turns caching off.
+    """
+    versions = CacheVersions(os.getenv("RESULT_CACHE_VERSIONS_PATH", DEFAULT_VERSIONS_PATH), database_name)
+    return ResultCache(
+        ttl=float(os.getenv("RESULT_CACHE_TTL", DEFAULT_TTL_SECONDS)),
+        max_entries=int(os.getenv("RESULT_CACHE_ENTRIES", DEFAULT_MAX_ENTRIES)),
+        versions=versions,
+    )
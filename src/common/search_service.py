@@ -0,0 +1,196 @@
+import asyncio
+import time
+
+import numpy as np
+from azure.cosmos import exceptions
+
+from common.metrics import WIDE_BUCKETS, parse_query_metrics
+from common.queries import full_text_ranking_query, vector_search_query
+
+# The demo's three containers, by the label the app shows for each index type
+INDEX_CONTAINERS = {
+    'No Index': 'search',
+    'QFLAT & Full Text Search Index': 'search_qflat',
+    'DiskANN & Full Text Search Index': 'search_diskann',
+}
+
+# Defaults for client-side hybrid search: the k in 1 / (k + rank), and candidates per arm
+RRF_K = 60
+DEFAULT_CANDIDATE_DEPTH = 50
+
+# Results fetched per round trip; the service returns a continuation token while there are more
+DEFAULT_PAGE_SIZE = 10
+
+
+def weighted_rrf(rankings, weights, k=RRF_K, key="id"):
+    """Fuse ranked result lists with weighted reciprocal rank fusion, best first.
+
+    Each item scores the sum over lists of weight / (k + rank), with ranks starting at 1. An
+    item found by several lists is returned once, as first seen, with its fused RRFScore.
+    """
+    positions_by_key = {}
+    items = []
+    for ranking in rankings:
+        for item in ranking:
+            if item[key] not in positions_by_key:
+                positions_by_key[item[key]] = len(items)
+                items.append(item)
+    scores = np.zeros(len(items))
+    for ranking, weight in zip(rankings, weights):
+        positions = np.fromiter((positions_by_key[item[key]] for item in ranking), dtype=np.int64, count=len(ranking))
+        np.add.at(scores, positions, weight / (k + 1 + np.arange(len(ranking))))
+    order = np.argsort(-scores, kind="stable")
+    return [dict(items[position], RRFScore=float(scores[position])) for position in order]
+
+
+def server_time_ms(query_metrics):
+    """totalExecutionTimeInMs from an x-ms-documentdb-query-metrics header."""
+    return parse_query_metrics(query_metrics).get("totalExecutionTimeInMs", 0.0)
+
+
+class QueryStats:
+    """A response hook that adds up charge and server time over every page of a query.
+
+    The SDK calls the hook for each page it fetches, across all partitions, and once more with
+    the result iterator itself; only page responses carry a charge, so the rest are ignored.
+    With a metrics registry, every field of each page's query metrics is recorded under labels.
+    """
+
+    def __init__(self, metrics=None, **labels):
+        self.metrics = metrics
+        self.labels = labels
+        self.clear()
+
+    def clear(self):
+        self.request_charge = 0.0
+        self.server_time_ms = 0.0
+        self.pages = 0
+
+    def __call__(self, headers, result):
+        if not isinstance(result, dict):
+            return
+        charge = float(headers.get('x-ms-request-charge', 0))
+        query_metrics = headers.get('x-ms-documentdb-query-metrics')
+        self.pages += 1
+        self.request_charge += charge
+        self.server_time_ms += server_time_ms(query_metrics)
+        if self.metrics is not None:
+            self.metrics.observe("page_request_charge", charge, "Request charge per page, in RU", WIDE_BUCKETS, **self.labels)
+            self.metrics.observe_query_metrics(query_metrics, **self.labels)
+
+
+class SearchResult:
+    def __init__(self, index, items, latency, request_charge, server_time, error=None, arms=None, pages=0):
+        self.index = index
+        self.items = items
+        # Seconds, end to end on the client and summed over server executions
+        self.latency = latency
+        self.request_charge = request_charge
+        self.server_time = server_time
+        self.error = error
+        # For client-side hybrid search, the result of each arm by name
+        self.arms = arms
+        self.pages = pages
+        # Set on results served from a result cache rather than queried
+        self.cached = False
+
+
+class SearchService:
+    """Runs one query against any of the index containers, concurrently when several are asked for.
+
+    Works on a synchronous database client so it can be used from Streamlit callbacks as well
+    as scripts; each container query runs in its own worker thread. With a metrics registry,
+    the time to the first page, each later page and the whole query are recorded per index.
+    """
+
+    def __init__(self, database, containers=INDEX_CONTAINERS, metrics=None):
+        self.containers = {index: database.get_container_client(name) for index, name in containers.items()}
+        self.metrics = metrics
+
+    def _observe(self, name, seconds, index):
+        if self.metrics is not None:
+            self.metrics.observe(name, seconds, index=index)
+
+    def search(self, query, parameters=None, indexes=None, page_size=DEFAULT_PAGE_SIZE):
+        """Run the query against the given indexes (all of them by default) and return a SearchResult per index."""
+        return asyncio.run(self.search_async(query, parameters, indexes, page_size))
+
+    async def search_async(self, query, parameters=None, indexes=None, page_size=DEFAULT_PAGE_SIZE):
+        indexes = list(indexes or self.containers)
+        return list(await asyncio.gather(
+            *(asyncio.to_thread(self.search_index, index, query, parameters, page_size) for index in indexes)))
+
+    def search_index(self, index, query, parameters=None, page_size=DEFAULT_PAGE_SIZE):
+        result = None
+        for result in self.search_pages(index, query, parameters, page_size):
+            pass
+        return result
+
+    def search_pages(self, index, query, parameters=None, page_size=DEFAULT_PAGE_SIZE, continuation_token=None):
+        """Fetch the query's results page by page, yielding a SearchResult with everything fetched so far after each page.
+
+        Request charge and server time are summed over the pages, so the last result covers the
+        whole query. On an error the last result carries it, along with the pages fetched before it.
+        The yielded results share one items list, which grows as later pages arrive.
+        """
+        container = self.containers[index]
+        stats = QueryStats(self.metrics, index=index)
+        items = []
+        pages = 0
+        start = time.perf_counter()
+        try:
+            pager = container.query_items(
+                query, parameters=parameters, enable_cross_partition_query=True, max_item_count=page_size,
+                populate_query_metrics=True, response_hook=stats).by_page(continuation_token)
+            page_start = start
+            for page in pager:
+                items.extend(page)
+                pages += 1
+                # The first page includes dispatching the query; time spent by the caller between pages is not counted
+                self._observe("query_dispatch_seconds" if pages == 1 else "page_fetch_seconds",
+                              time.perf_counter() - page_start, index)
+                yield SearchResult(index, items, time.perf_counter() - start, stats.request_charge,
+                                   stats.server_time_ms / 1000, pages=pages)
+                page_start = time.perf_counter()
+            error = None
+        except exceptions.CosmosHttpResponseError as e:
+            error = e
+        self._observe("query_seconds", time.perf_counter() - start, index)
+        if error is not None or pages == 0:
+            yield SearchResult(index, [] if error else items, time.perf_counter() - start, stats.request_charge,
+                               stats.server_time_ms / 1000, error, pages=pages)
+
+    def hybrid_search(self, vector, keywords, indexes=None, **options):
+        """Client-side hybrid search against the given indexes; see hybrid_search_index for the options."""
+        return asyncio.run(self.hybrid_search_async(vector, keywords, indexes, **options))
+
+    async def hybrid_search_async(self, vector, keywords, indexes=None, **options):
+        indexes = list(indexes or self.containers)
+        return list(await asyncio.gather(
+            *(self._hybrid_search(index, vector, keywords, **options) for index in indexes)))
+
+    def hybrid_search_index(self, index, vector, keywords, **options):
+        return asyncio.run(self._hybrid_search(index, vector, keywords, **options))
+
+    async def _hybrid_search(self, index, vector, keywords, top_k=10, vector_depth=DEFAULT_CANDIDATE_DEPTH,
+                             text_depth=DEFAULT_CANDIDATE_DEPTH, vector_weight=1.0, text_weight=1.0, rrf_k=RRF_K):
+        """Run the vector and full-text arms concurrently, each for its own number of candidates, and fuse them with weighted RRF.
+
+        Shallower arms cost less RU and latency; deeper arms give the fusion more to work with.
+        RU and server time are the sums over both arms, and latency covers both plus the fusion.
+        """
+        start = time.perf_counter()
+        arms = [("vector", vector_search_query(vector, vector_depth), vector_weight, vector_depth),
+                ("text", full_text_ranking_query(keywords, text_depth), text_weight, text_depth)]
+        arms = [arm for arm in arms if arm[2] > 0 and (arm[0] != "text" or keywords)]
+        results = await asyncio.gather(
+            # Each arm's candidates come back in one page, since its TOP is its depth
+            *(asyncio.to_thread(self.search_index, index, query, parameters, depth)
+              for _, (query, parameters), _, depth in arms))
+        error = next((result.error for result in results if result.error is not None), None)
+        items = [] if error else weighted_rrf([result.items for result in results], [weight for _, _, weight, _ in arms], rrf_k)[:top_k]
+        return SearchResult(
+            index, items, time.perf_counter() - start,
+            sum(result.request_charge for result in results), sum(result.server_time for result in results),
+            error, arms={name: result for (name, _, _, _), result in zip(arms, results)},
+            pages=sum(result.pages for result in results))
@@ -0,0 +1,106 @@
+import hashlib
+import os
+
+import numpy as np
+
+# Compact representations of the stored embeddings. A transform reduces vectors to fewer
+# dimensions, by keeping the leading components or by projecting onto principal components
+# fitted on a sample, and then encodes them for the document:
+#   float32  full precision, as the loader has always written
+#   float16  values rounded to 4 significant digits, about float16 precision; shorter JSON,
+#            still stored by the service as float32
+#   int8     each vector scaled so its largest component is 127 and rounded to integers; the
+#            containers declare dataType int8, and cosine similarity ignores the scale
+# The loader applies the transform to every document and the app to every query vector, so the
+# two stay in the same space. src/data/vector_compaction.py fits transforms and reports on them.
+
+METHODS = ("none", "truncate", "pca")
+ENCODINGS = ("float32", "float16", "int8")
+
+
+def _normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class VectorTransform:
+    def __init__(self, method="none", dimensions=None, encoding="float32", mean=None, components=None):
+        if method not in METHODS:
+            raise ValueError(f"Unknown reduction method {method}; expected one of {', '.join(METHODS)}")
+        if encoding not in ENCODINGS:
+            raise ValueError(f"Unknown encoding {encoding}; expected one of {', '.join(ENCODINGS)}")
+        if method == "pca" and components is None:
+            raise ValueError("A PCA transform needs components; fit one with fit_pca")
+        self.method = method
+        self.dimensions = int(dimensions) if dimensions else None
+        self.encoding = encoding
+        self.mean = None if mean is None else np.asarray(mean, dtype=np.float32)
+        self.components = None if components is None else np.asarray(components, dtype=np.float32)
+
+    @property
+    def data_type(self):
+        """The dataType for the containers' vector_embedding_policy."""
+        return "int8" if self.encoding == "int8" else "float32"
+
+    def output_dimensions(self, input_dimensions):
+        return self.dimensions or input_dimensions
+
+    def describe(self):
+        dimensions = self.dimensions or "all"
+        description = f"{self.method} {dimensions} {self.encoding}"
+        if self.method == "pca":
+            # A refit with the same settings projects onto a different basis, so the fit is part of it
+            fit = hashlib.sha256(self.mean.tobytes() + self.components.tobytes()).hexdigest()[:8]
+            description += f" #{fit}"
+        return description
+
+    def reduce(self, vectors):
+        """Rows of float32 vectors reduced to the transform's dimensions and unit-normalized."""
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        if self.method == "pca":
+            vectors = (vectors - self.mean) @ self.components.T
+        elif self.method == "truncate":
+            vectors = vectors[:, :self.dimensions]
+        return _normalize_rows(vectors)
+
+    def encode(self, vector):
+        """One vector as it is written to a document or sent as a query parameter."""
+        reduced = self.reduce(vector)[0]
+        if self.encoding == "int8":
+            scale = 127 / max(float(np.abs(reduced).max()), 1e-12)
+            return np.round(reduced * scale).astype(np.int8).tolist()
+        if self.encoding == "float16":
+            return [float(f"{value:.4g}") for value in reduced.tolist()]
+        return reduced.tolist()
+
+    def save(self, path):
+        arrays = {"method": self.method, "dimensions": self.dimensions or 0, "encoding": self.encoding}
+        if self.method == "pca":
+            arrays.update(mean=self.mean, components=self.components)
+        with open(path, "wb") as file:
+            np.savez(file, **arrays)
+
+
+def fit_pca(sample, dimensions, encoding="float32"):
+    """A transform onto the top principal components of a sample of vectors."""
+    sample = np.asarray(sample, dtype=np.float32)
+    if dimensions > min(sample.shape):
+        raise ValueError(f"PCA to {dimensions} dimensions needs at least {dimensions} sample vectors")
+    mean = sample.mean(axis=0)
+    _, _, components = np.linalg.svd(sample - mean, full_matrices=False)
+    return VectorTransform("pca", dimensions, encoding, mean, components[:dimensions])
+
+
+def load_transform(path):
+    with np.load(path) as arrays:
+        method = str(arrays["method"])
+        return VectorTransform(
+            method, int(arrays["dimensions"]) or None, str(arrays["encoding"]),
+            arrays["mean"] if method == "pca" else None, arrays["components"] if method == "pca" else None)
+
+
+def transform_from_env(path=None):
+    """The transform saved at VECTOR_TRANSFORM_PATH, or None to store vectors as they are embedded."""
+    path = path or os.getenv("VECTOR_TRANSFORM_PATH")
+    return load_transform(path) if path else None
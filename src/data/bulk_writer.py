@@ -0,0 +1,144 @@
+import asyncio
+
+from azure.cosmos import documents, exceptions
+
+from rate_governor import RuGovernor
+
+# Service limit on the number of operations in one transactional batch
+MAX_BATCH_OPERATIONS = 100
+# Upper bound on how far repeated throttling stretches the server's retry-after
+MAX_BACKOFF_FACTOR = 8
+# Share of provisioned throughput targeted with target_ru='auto', leaving headroom for queries
+AUTO_TARGET_UTILIZATION = 0.9
+
+
+def no_throttle_retry_policy():
+    """A connection policy that hands 429s straight back so the writer can back off across all requests."""
+    policy = documents.ConnectionPolicy()
+    policy.RetryOptions = documents.RetryOptions(max_retry_attempt_count=0)
+    return policy
+
+
+def partition_key_value(item, path):
+    value = item
+    for part in path.strip('/').split('/'):
+        value = value.get(part) if isinstance(value, dict) else None
+    return value
+
+
+class ThrottleState:
+    """Backoff shared by every request to one container.
+
+    A 429 pauses all writers to the container for the retry-after the service asked for,
+    stretched while throttling keeps recurring and reset by the next success.
+    """
+
+    def __init__(self):
+        self.resume_at = 0.0
+        self.consecutive = 0
+        self.throttled = 0
+
+    async def wait(self):
+        delay = self.resume_at - asyncio.get_running_loop().time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def throttle(self, retry_after):
+        self.throttled += 1
+        self.consecutive += 1
+        backoff = retry_after * min(2 ** (self.consecutive - 1), MAX_BACKOFF_FACTOR)
+        self.resume_at = max(self.resume_at, asyncio.get_running_loop().time() + backoff)
+
+    def success(self):
+        self.consecutive = 0
+
+
+class ContainerWriter:
+    """Upserts items into one container, grouping items that share a partition key into transactional batches.
+
+    Items alone in their logical partition are sent as single upserts, so for containers
+    partitioned on /id this is a bounded-concurrency upsert stream. Every request goes through
+    a RuGovernor, which paces the container at target_ru RU/s when one is given; 'auto' targets
+    90% of the container's provisioned throughput. With budget_share, a loader process that is one
+    of several writing to the container takes that fraction of the target.
+    """
+
+    def __init__(self, name, container, concurrency=10, transactional=False, max_attempts=10, target_ru=None,
+                 budget_share=1.0):
+        self.name = name
+        self.container = container
+        self.transactional = transactional
+        self.max_attempts = max_attempts
+        self.target_ru = target_ru
+        self.budget_share = budget_share
+        self.partition_key_path = '/id'
+        self.governor = RuGovernor(None if target_ru in (None, 'auto') else target_ru * budget_share, concurrency=concurrency)
+        self.throttle = ThrottleState()
+        self.request_charge = 0.0
+        self.documents = 0
+
+    async def initialize(self):
+        if self.transactional:
+            properties = await self.container.read()
+            self.partition_key_path = properties['partitionKey']['paths'][0]
+        if self.target_ru == 'auto':
+            throughput = await self.container.get_throughput()
+            provisioned = throughput.auto_scale_max_throughput or throughput.offer_throughput
+            self.governor.set_target(AUTO_TARGET_UTILIZATION * provisioned * self.budget_share)
+            print(f"Pacing {self.name} at {self.governor.target:.0f} RU/s of {provisioned} provisioned.")
+
+    async def write(self, items):
+        """Upsert items and return, per item, whether it was written."""
+        operations = []
+        if self.transactional:
+            groups = {}
+            for position, item in enumerate(items):
+                key = partition_key_value(item, self.partition_key_path)
+                groups.setdefault(str(key), (key, []))[1].append(position)
+            for key, positions in groups.values():
+                for start in range(0, len(positions), MAX_BATCH_OPERATIONS):
+                    operations.append((key, positions[start:start + MAX_BATCH_OPERATIONS]))
+        else:
+            operations = [(None, [position]) for position in range(len(items))]
+
+        results = [False] * len(items)
+
+        async def run(key, positions):
+            chunk = [items[position] for position in positions]
+            written = await self._write_chunk(key, chunk)
+            for position in positions:
+                results[position] = written
+
+        await asyncio.gather(*(run(key, positions) for key, positions in operations))
+        return results
+
+    async def _write_chunk(self, key, chunk):
+        for _ in range(self.max_attempts):
+            await self.throttle.wait()
+            try:
+                async with self.governor.request(len(chunk)) as request:
+                    if len(chunk) == 1:
+                        await self.container.upsert_item(body=chunk[0], response_hook=request.record)
+                    else:
+                        operations = [("upsert", (item,)) for item in chunk]
+                        await self.container.execute_item_batch(operations, partition_key=key, response_hook=request.record)
+                self.request_charge += request.charge
+                self.throttle.success()
+                self.documents += len(chunk)
+                return True
+            except (exceptions.CosmosHttpResponseError, exceptions.CosmosBatchOperationError) as e:
+                headers = e.headers or {}
+                if e.status_code != 429:
+                    print(f"Failed to insert {len(chunk)} document(s) into {self.name}: {e}")
+                    return False
+                self.request_charge += float(headers.get('x-ms-request-charge', 0))
+                self.throttle.throttle(float(headers.get('x-ms-retry-after-ms', 100)) / 1000)
+        print(f"Giving up on {len(chunk)} document(s) for {self.name} after {self.max_attempts} throttled attempts.")
+        return False
+
+    def readout(self):
+        return f"{self.name}: {self.governor.readout()}, {self.throttle.throttled} throttled"
+
+    def summary(self):
+        per_document = self.request_charge / self.documents if self.documents else 0.0
+        return f"{self.name}: {self.request_charge:.0f} RU ({per_document:.2f} RU/doc), {self.throttle.throttled} throttled"
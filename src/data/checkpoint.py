@@ -0,0 +1,116 @@
+import hashlib
+import json
+import os
+import sqlite3
+
+
+class Checkpoint:
+    """Tracks, per container, how far into the input every item has been written.
+
+    Items complete out of order, so each container keeps a watermark: the offset of the
+    first item that has not been written yet. Everything below it is committed, and a
+    rerun resumes from the lowest watermark across containers. Items that failed are
+    recorded separately and do not hold the watermark back; a rerun retries them.
+    """
+
+    def __init__(self, path, source, database_name, container_names):
+        self.path = path
+        self.source = source
+        self.database_name = database_name
+        self.offsets = {name: 0 for name in container_names}
+        self.failed = {name: set() for name in container_names}
+        self._done = {name: set() for name in container_names}
+
+        if os.path.exists(path):
+            with open(path, 'r') as file:
+                data = json.load(file)
+            if data.get('source') != source or data.get('database') != database_name:
+                raise ValueError(f"Checkpoint {path} was written for {data.get('source')} in database "
+                                 f"{data.get('database')}; delete it or pass a different --checkpoint path.")
+            for name, offset in data.get('containers', {}).items():
+                if name in self.offsets:
+                    self.offsets[name] = offset
+            for name, offsets in data.get('failed', {}).items():
+                if name in self.failed:
+                    self.failed[name] = set(offsets)
+
+    def resume_offset(self):
+        return min(self.offsets.values(), default=0)
+
+    def failed_offsets(self):
+        """Offsets below the watermarks that still have to be retried."""
+        return set().union(*self.failed.values())
+
+    def is_committed(self, container_name, offset):
+        return offset < self.offsets[container_name] and offset not in self.failed[container_name]
+
+    def mark_done(self, container_name, offset):
+        self.failed[container_name].discard(offset)
+        self._advance(container_name, offset)
+
+    def mark_failed(self, container_name, offset):
+        self.failed[container_name].add(offset)
+        self._advance(container_name, offset)
+
+    def _advance(self, container_name, offset):
+        if offset < self.offsets[container_name]:
+            return
+        done = self._done[container_name]
+        done.add(offset)
+        watermark = self.offsets[container_name]
+        while watermark in done:
+            done.remove(watermark)
+            watermark += 1
+        self.offsets[container_name] = watermark
+
+    def save(self):
+        data = {'source': self.source, 'database': self.database_name, 'containers': self.offsets,
+                'failed': {name: sorted(offsets) for name, offsets in self.failed.items() if offsets}}
+        # Write to a temporary file and swap it in so a crash mid-write never leaves a torn checkpoint
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump(data, file, indent=2)
+        os.replace(temp_path, self.path)
+
+
+def content_hash(item, embedding_model=None):
+    """Hash the prepared document, plus the model that will embed it when it has no embedding yet."""
+    payload = json.dumps(item, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    if embedding_model is not None:
+        payload += '\0' + embedding_model
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ContentHashStore:
+    """Remembers the content hash last written for each document id in each container."""
+
+    def __init__(self, path):
+        # Loader workers share the file, and each waits for the others' flushes
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS content_hashes ("
+            "container TEXT NOT NULL, id TEXT NOT NULL, hash TEXT NOT NULL, "
+            "PRIMARY KEY (container, id))"
+        )
+        # Lookups are by id across containers, which the primary key cannot serve
+        self.connection.execute("CREATE INDEX IF NOT EXISTS content_hashes_id ON content_hashes (id)")
+        self._pending = []
+
+    def get(self, item_id):
+        rows = self.connection.execute("SELECT container, hash FROM content_hashes WHERE id = ?", (str(item_id),))
+        return dict(rows.fetchall())
+
+    def put(self, container_name, item_id, item_hash):
+        # Buffered until the next flush so the write stage never waits on a disk sync
+        self._pending.append((container_name, str(item_id), item_hash))
+
+    def flush(self):
+        if self._pending:
+            with self.connection:
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO content_hashes (container, id, hash) VALUES (?, ?, ?)", self._pending)
+            self._pending = []
+
+    def close(self):
+        self.flush()
+        self.connection.close()
@@ -1,129 +1,177 @@
 import argparse
 import os
-import json
+import sys
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
-from asyncio import Semaphore
 
-import requests
-from azure.cosmos import CosmosClient, PartitionKey, exceptions
+from azure.cosmos.aio import CosmosClient
 from dotenv import load_dotenv
-from openai import AzureOpenAI
+from openai import AsyncAzureOpenAI
+
+# Modules shared with the streamlit app live in src/common
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from common.clients import embedding_backend, embedding_model, local_backend_path, local_embedder, search_backend
+from common.embedding_cache import cache_from_env
+from common.result_cache import DEFAULT_VERSIONS_PATH, CacheVersions
+from common.local_backend import AsyncFakeEmbeddingsClient, AsyncLocalCosmosClient
+from common.local_embedder import AsyncLocalEmbeddingsClient
+from common.provisioning import embedding_dimensions, provision, transform_policy
+from common.vector_transform import transform_from_env
+from bulk_writer import ContainerWriter, no_throttle_retry_policy
+from checkpoint import Checkpoint, ContentHashStore
+from embedding_batcher import DEFAULT_MAX_BATCH_ITEMS, DEFAULT_MAX_BATCH_TOKENS, EmbeddingBatcher
+from json_stream import iter_json_items
+from pipeline import IngestPipeline
+from rate_governor import MAX_CONCURRENCY
+from sharding import SHARD_MODES, parse_shard, plan_shards, run_workers, write_shard_stats
 
 # Load environment variables
 load_dotenv()
 
-# Initialize Cosmos DB client
+# Cosmos DB connection settings
 endpoint = os.getenv("AZURE_COSMOSDB_ENDPOINT")
 key = os.getenv("AZURE_COSMOSDB_KEY")
 
-# Initialize OpenAI client
-openai_client = AzureOpenAI(
-    api_key=os.getenv("AZURE_OPENAI_APIKEY"),
-    api_version="2023-05-15",
-    azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT")
-)
 
+def create_openai_client(embedder='openai'):
+    if embedder == 'fake':
+        return AsyncFakeEmbeddingsClient(embedding_dimensions())
+    if embedder == 'local':
+        return AsyncLocalEmbeddingsClient(local_embedder(), embedding_model('local'))
+    return AsyncAzureOpenAI(
+        api_key=os.getenv("AZURE_OPENAI_APIKEY"),
+        api_version="2023-05-15",
+        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT")
+    )
 
-def initialize_cosmos(database_name):
-    client = CosmosClient(endpoint, key)
+
+def create_cosmos_client(backend, database_name, vector_transform=None, embedder=None, **options):
+    if backend == 'local':
+        client = AsyncLocalCosmosClient(local_backend_path())
+        # The local store may start empty, so create the containers with the app's policies, sized for the embedder
+        provision(client.client, database_name, **transform_policy(vector_transform, embedding_dimensions(embedder)))
+        return client
+    return CosmosClient(endpoint, key, **options)
+
+
+def initialize_cosmos(client, database_name):
     database = client.get_database_client(database_name)
     container_names = ['search', 'search_qflat', 'search_diskann']
     containers = {name: database.get_container_client(name) for name in container_names}
     return containers
 
 
-def load_json_data(file_path):
-    if file_path.startswith("http://") or file_path.startswith("https://"):
-        # Handle URLs
-        response = requests.get(file_path)
-        response.raise_for_status()  # Raise an error if the request fails
-        return response.json()
-    elif os.path.exists(file_path):
-        # Handle local file paths
-        with open(file_path, 'r') as file:
-            return json.load(file)
-    else:
-        raise ValueError(f"Invalid file path or URL: {file_path}")
-
-
-def generate_embedding(text):
-    response = openai_client.embeddings.create(input=text, model="text-embedding-ada-002")
-    json_response = response.model_dump_json(indent=2)
-    parsed_response = json.loads(json_response)
-    return parsed_response['data'][0]['embedding']
-
-
-def upsert_item_sync(container, item):
-    try:
-        container.upsert_item(body=item)
-    except exceptions.CosmosHttpResponseError as e:
-        print(f"Failed to insert document: {e.message}")
-
-
-async def upsert_items_async(containers, items, text_field_name, max_concurrency, vector_field_name=None, re_embed=False):
-    semaphore = Semaphore(max_concurrency)
-    loop = asyncio.get_event_loop()
-    progress_counter = 0
-
-    async def process_item(item):
-        nonlocal progress_counter
-        async with semaphore:
-            # Rename vector_field_name to embedding if present
-            if vector_field_name in item:
-                # Re-embed the text if re_embed is True
-                if re_embed:
-                    item['embedding'] = generate_embedding(item[text_field_name])
-                    # get rid of previous vector_field_name, not needed anymore
-                    item.pop(vector_field_name)
-                    # Rename text_field_name to text so that it matches the streamlit app
-                    item['text'] = item.pop(text_field_name)
-                else:
-                    # Rename vector_field_name to embedding so that it matches the streamlit app
-                    item['embedding'] = item.pop(vector_field_name)
-                    # Rename text_field_name to text so that it matches the streamlit app
-                    item['text'] = item.pop(text_field_name)
-            # Generate embedding for text_field_name if present
-            elif text_field_name in item:
-                item['embedding'] = generate_embedding(item[text_field_name])
-                # Rename text_field_name to text so that it matches the streamlit app
-                item['text'] = item.pop(text_field_name)
-
-            # Upsert item to all containers
-            for container in containers.values():
-                await loop.run_in_executor(None, upsert_item_sync, container, item)
-
-            # Update progress counter
-            progress_counter += 1
-            if progress_counter % 100 == 0:
-                print(f"{progress_counter} records processed.")
-
-    # Create tasks for processing items
-    tasks = [process_item(item) for item in items]
-    await asyncio.gather(*tasks)
-
+def ru_target(value):
+    return value if value == 'auto' else float(value)
 
 
 async def main():
     # Parse command-line arguments
     parser = argparse.ArgumentParser(description="Upsert items into Cosmos DB.")
     parser.add_argument("--text_field_name", required=True, help="The name of the field containing text to generate embeddings.")
-    parser.add_argument("--path_to_json_array", required=True, help="The path to the JSON file containing the array of items.")
+    parser.add_argument("--path_to_json_array", required=True, help="The path or URL of the JSON array or JSON Lines file containing the items.")
+    parser.add_argument("--input_format", choices=['auto', 'array', 'jsonl'], default='auto', help="Format of the input; 'auto' detects a JSON array or JSON Lines from the first character.")
     parser.add_argument("--database_name", required=True, help="The name of the Cosmos DB database.")
-    parser.add_argument("--concurrency", type=int, default=10, help="Maximum number of concurrent upsert operations.")
+    parser.add_argument("--concurrency", type=int, default=10, help="Maximum number of concurrent upsert operations per container; the starting point when --target_ru is set.")
+    parser.add_argument("--bulk", action="store_true", help="Write in bulk: group items by partition key into transactional batches and back off on throttling across all writers.")
+    parser.add_argument("--bulk_size", type=int, default=100, help="Number of items handed to the containers at once in bulk mode.")
+    parser.add_argument("--target_ru", type=ru_target, help="RU/s to pace writes at per container, or 'auto' for 90%% of each container's provisioned throughput. Concurrency is tuned to reach it.")
+    parser.add_argument("--embed_concurrency", type=int, default=4, help="Maximum number of concurrent embedding requests.")
+    parser.add_argument("--queue_size", type=int, default=1000, help="Maximum number of items waiting between pipeline stages.")
+    parser.add_argument("--report_interval", type=float, default=10, help="Seconds between per-stage throughput reports.")
     parser.add_argument("--vector_field_name", help="The name of the field containing pre-generated embeddings.")
     parser.add_argument("--re_embed", type=bool, default=False, help="Whether to re-embed the text or not.")
+    parser.add_argument("--embed_batch_size", type=int, default=DEFAULT_MAX_BATCH_ITEMS, help="Maximum number of texts sent in one embedding request.")
+    parser.add_argument("--embed_batch_tokens", type=int, default=DEFAULT_MAX_BATCH_TOKENS, help="Approximate token budget for one embedding request.")
+    parser.add_argument("--embedding_cache", help="Path of the SQLite embedding cache shared with the app (defaults to EMBEDDING_CACHE_PATH or embedding-cache.sqlite).")
+    parser.add_argument("--no_embedding_cache", action="store_true", help="Always call the embedding service, without reading or filling the cache.")
+    parser.add_argument("--checkpoint", help="Path of a checkpoint file; a rerun with the same file resumes from the last committed item.")
+    parser.add_argument("--backend", choices=['cosmos', 'local'], default=search_backend(), help="Write to Cosmos DB, or to the local stand-in kept in LOCAL_BACKEND_PATH (defaults to SEARCH_BACKEND).")
+    parser.add_argument("--embedder", choices=['openai', 'local', 'fake'], default=embedding_backend(), help="Embed with Azure OpenAI, a local CPU model (LOCAL_EMBEDDING_MODEL), or the deterministic fake embedder for offline runs (defaults to EMBEDDING_BACKEND).")
+    parser.add_argument("--hash_store", help="Path of a SQLite file of content hashes; items unchanged since they were last written are skipped.")
+    parser.add_argument("--vector_transform", default=os.getenv("VECTOR_TRANSFORM_PATH"), help="Reduce and encode every embedding with this transform from vector_compaction.py before writing it; the app needs the same VECTOR_TRANSFORM_PATH.")
+    parser.add_argument("--result_cache_versions", default=os.getenv("RESULT_CACHE_VERSIONS_PATH", DEFAULT_VERSIONS_PATH), help="Path of the container versions file the app checks before serving cached search results.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of loader processes to split the input across, each with its own clients, checkpoint and share of --target_ru.")
+    parser.add_argument("--shard_by", choices=SHARD_MODES, default='auto', help="With --workers, split a local JSON Lines file by byte range ('bytes') or any input by id hash ('id'); 'auto' uses byte ranges when it can.")
+    # Set by the parent process for each worker
+    parser.add_argument("--shard", help=argparse.SUPPRESS)
+    parser.add_argument("--shard_range", help=argparse.SUPPRESS)
+    parser.add_argument("--shard_stats", help=argparse.SUPPRESS)
     args = parser.parse_args()
 
-    # Initialize containers and load data
-    containers = initialize_cosmos(args.database_name)
-    items = load_json_data(args.path_to_json_array)
-
-    # Call the upsert function with the specified parameters
-    await upsert_items_async(containers, items, text_field_name=args.text_field_name, max_concurrency=args.concurrency, vector_field_name=args.vector_field_name, re_embed=args.re_embed)
+    if args.shard is None and args.workers > 1:
+        try:
+            shards = plan_shards(args.path_to_json_array, args.input_format, args.workers, args.shard_by)
+        except ValueError as e:
+            parser.error(str(e))
+        codes = await run_workers(os.path.abspath(__file__), sys.argv[1:], shards)
+        if any(codes):
+            sys.exit(f"{sum(1 for code in codes if code)} of {len(codes)} workers failed; rerun the same command to resume them from their checkpoints.")
+        return
+    shard = parse_shard(args.shard, args.shard_range) if args.shard else None
+
+    # Initialize clients and stream the data in; items are parsed as the pipeline asks for them
+    items = iter_json_items(args.path_to_json_array, args.input_format, shard.byte_range if shard else None)
+    if shard is not None:
+        items = shard.filter(items)
+    # In bulk or paced mode 429s come back to the writers, which back off per container instead of per request
+    cosmos_options = {'connection_policy': no_throttle_retry_policy()} if args.bulk or args.target_ru else {}
+    vector_transform = transform_from_env(args.vector_transform)
+    async with create_cosmos_client(args.backend, args.database_name, vector_transform, args.embedder, **cosmos_options) as cosmos_client, create_openai_client(args.embedder) as openai_client:
+        containers = initialize_cosmos(cosmos_client, args.database_name)
+        writers = {
+            name: ContainerWriter(name, container, concurrency=args.concurrency, transactional=args.bulk, target_ru=args.target_ru,
+                                  budget_share=1 / shard.count if shard else 1.0)
+            for name, container in containers.items()
+        }
+        embedding_cache = None if args.no_embedding_cache else cache_from_env(args.embedding_cache)
+        model = embedding_model(args.embedder)
+        batcher = EmbeddingBatcher(openai_client, model=model, max_items=args.embed_batch_size, max_tokens=args.embed_batch_tokens, cache=embedding_cache)
+        checkpoint = None
+        if args.checkpoint and shard is not None:
+            # Offsets count the shard's own items, so each shard resumes from its own file
+            checkpoint = Checkpoint(shard.checkpoint_path(args.checkpoint), f"{args.path_to_json_array} ({shard.describe()})",
+                                    args.database_name, containers)
+        elif args.checkpoint:
+            checkpoint = Checkpoint(args.checkpoint, args.path_to_json_array, args.database_name, containers)
+        hash_store = ContentHashStore(args.hash_store) if args.hash_store else None
+        write_batch_size = args.bulk_size if args.bulk else 1
+        write_concurrency = args.concurrency
+        if args.target_ru:
+            # Each write worker holds one batch, so with too few of them the governor never has writes
+            # waiting on it and cannot raise concurrency; keep enough in flight to reach its ceiling
+            write_concurrency = max(args.concurrency, -(-MAX_CONCURRENCY // write_batch_size))
+        pipeline = IngestPipeline(
+            writers,
+            batcher,
+            text_field_name=args.text_field_name,
+            vector_field_name=args.vector_field_name,
+            re_embed=args.re_embed,
+            embed_concurrency=args.embed_concurrency,
+            write_concurrency=write_concurrency,
+            write_batch_size=write_batch_size,
+            queue_size=args.queue_size,
+            report_interval=args.report_interval,
+            checkpoint=checkpoint,
+            hash_store=hash_store,
+            # Written containers are bumped as the load progresses, so the app drops its cached results for them
+            cache_versions=CacheVersions(args.result_cache_versions, args.database_name),
+            vector_transform=vector_transform
+        )
+        try:
+            await pipeline.run(items)
+            if args.shard_stats:
+                write_shard_stats(args.shard_stats, shard, pipeline.summary())
+        finally:
+            if hash_store is not None:
+                hash_store.close()
+            if embedding_cache is not None:
+                print(f"Embedding cache: {embedding_cache.stats()}")
+                embedding_cache.close()
 
     # how to call this function
     # python src/data/data-loader.py --text_field_name "overview" --path_to_json_array "https://raw.githubusercontent.com/microsoft/AzureDataRetrievalAugmentedGenerationSamples/refs/heads/main/DataSet/Movies/MovieLens-4489-256D.json" --database_name "ignite2024demo" --concurrency 20 --vector_field_name "vector" --re_embed True
+    # python src/data/data-loader.py --text_field_name "overview" --path_to_json_array "movies.jsonl" --database_name "ignite2024demo" --vector_field_name "vector" --workers 4 --checkpoint loader-checkpoint.json
 
 
 if __name__ == "__main__":
@@ -0,0 +1,130 @@
+import asyncio
+
+import openai
+
+from common.embedding_decode import ENCODING_FORMAT, decode_embeddings
+
+# Azure OpenAI accepts up to 16 inputs per request for text-embedding-ada-002 on older api versions
+DEFAULT_MAX_BATCH_ITEMS = 16
+DEFAULT_MAX_BATCH_TOKENS = 64000
+
+# Errors worth retrying as-is; anything else that fails a multi-input batch gets split instead
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+# Errors caused by the inputs themselves; any other status (bad key, no permission, unknown
+# deployment) fails every request alike, so it stops the load instead
+INPUT_ERRORS = (
+    openai.BadRequestError,
+    openai.UnprocessableEntityError,
+)
+
+
+def estimate_tokens(text):
+    # cl100k averages roughly four characters per token for English prose, which is
+    # close enough to keep a batch under the request budget without pulling in tiktoken
+    return len(text) // 4 + 1
+
+
+def iter_batches(entries, max_items=DEFAULT_MAX_BATCH_ITEMS, max_tokens=DEFAULT_MAX_BATCH_TOKENS):
+    """Group (key, text) pairs into batches capped by item count and estimated token count."""
+    batch = []
+    batch_tokens = 0
+    for key, text in entries:
+        tokens = estimate_tokens(text)
+        if batch and (len(batch) >= max_items or batch_tokens + tokens > max_tokens):
+            yield batch
+            batch = []
+            batch_tokens = 0
+        batch.append((key, text))
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
+
+def retry_after_seconds(error, attempt):
+    response = getattr(error, "response", None)
+    if response is not None:
+        retry_after = response.headers.get("retry-after-ms")
+        if retry_after:
+            return float(retry_after) / 1000
+        retry_after = response.headers.get("retry-after")
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+    return min(2 ** attempt, 30)
+
+
+class EmbeddingBatcher:
+    """Embeds texts with multi-input requests on an async OpenAI client, splitting and retrying batches that fail.
+
+    With a cache, texts embedded before (by the loader or the app) are served from it, and
+    duplicate texts within one call are only sent once. Embeddings are float32 arrays, decoded
+    from the base64 the service returns, and are converted to lists only when written.
+    """
+
+    def __init__(self, client, model="text-embedding-ada-002", max_items=DEFAULT_MAX_BATCH_ITEMS,
+                 max_tokens=DEFAULT_MAX_BATCH_TOKENS, max_retries=5, cache=None):
+        self.client = client
+        self.model = model
+        self.max_items = max_items
+        self.max_tokens = max_tokens
+        self.max_retries = max_retries
+        self.cache = cache
+        self.requests = 0
+        self.failed_inputs = 0
+
+    async def embed(self, texts):
+        """Return one embedding per text, in order; texts that could not be embedded get None."""
+        embeddings = [None] * len(texts)
+        if self.cache is not None:
+            for position, vector in enumerate(self.cache.get_many(self.model, texts)):
+                if vector is not None:
+                    embeddings[position] = vector
+
+        # Send each distinct text once and fan the result back out to every position holding it
+        positions_by_text = {}
+        for position, text in enumerate(texts):
+            if embeddings[position] is None:
+                positions_by_text.setdefault(text, []).append(position)
+
+        for batch in iter_batches(((text, text) for text in positions_by_text), self.max_items, self.max_tokens):
+            batch_texts = [text for text, _ in batch]
+            vectors = await self._embed_batch(batch_texts)
+            for text, vector in zip(batch_texts, vectors):
+                for position in positions_by_text[text]:
+                    embeddings[position] = vector
+            if self.cache is not None:
+                self.cache.put_many(self.model, batch_texts, vectors)
+        return embeddings
+
+    async def _embed_batch(self, texts):
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.requests += 1
+                response = await self.client.embeddings.create(input=texts, model=self.model, encoding_format=ENCODING_FORMAT)
+                break
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    print(f"Giving up on a batch of {len(texts)} texts after {attempt + 1} attempts: {e}")
+                    self.failed_inputs += len(texts)
+                    return [None] * len(texts)
+                await asyncio.sleep(retry_after_seconds(e, attempt))
+            except INPUT_ERRORS as e:
+                # One bad input (too long, filtered, ...) fails the whole request, so bisect
+                # until the offending text is isolated and embed the rest
+                if len(texts) > 1:
+                    middle = len(texts) // 2
+                    return await self._embed_batch(texts[:middle]) + await self._embed_batch(texts[middle:])
+                print(f"Failed to embed text ({e.status_code}): {e.message}")
+                self.failed_inputs += 1
+                return [None]
+
+        # The service does not promise to return vectors in input order; rows are placed by index
+        return list(decode_embeddings(response))
@@ -0,0 +1,170 @@
+import codecs
+import json
+import os
+import re
+
+import requests
+
+CHUNK_SIZE = 1 << 16
+
+_WHITESPACE = re.compile(r'\s*')
+# Characters that can continue a number, so one that ends at them may go on in the next chunk
+_NUMBER_CHARACTERS = frozenset('0123456789.eE+-')
+_decoder = json.JSONDecoder()
+
+
+def is_url(file_path):
+    return file_path.startswith("http://") or file_path.startswith("https://")
+
+
+def iter_chunks(file_path, chunk_size=CHUNK_SIZE, byte_range=None):
+    """Yield raw bytes from a local file or an HTTP(S) URL without reading the whole body.
+
+    byte_range, a (start, end) pair, limits a local file to the bytes from start up to end.
+    """
+    if is_url(file_path):
+        # Handle URLs
+        with requests.get(file_path, stream=True) as response:
+            response.raise_for_status()  # Raise an error if the request fails
+            yield from response.iter_content(chunk_size=chunk_size)
+    elif os.path.exists(file_path):
+        # Handle local file paths
+        start, end = byte_range or (0, None)
+        with open(file_path, 'rb') as file:
+            file.seek(start)
+            remaining = None if end is None else end - start
+            while remaining is None or remaining > 0:
+                chunk = file.read(chunk_size if remaining is None else min(chunk_size, remaining))
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+    else:
+        raise ValueError(f"Invalid file path or URL: {file_path}")
+
+
+def iter_text(chunks):
+    # utf-8-sig drops a leading byte order mark, and the incremental decoder copes with
+    # multi-byte characters split across chunk boundaries
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    for chunk in chunks:
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    tail = decoder.decode(b'', final=True)
+    if tail:
+        yield tail
+
+
+class _TextBuffer:
+    """A sliding window over decoded text that only keeps what has not been parsed yet."""
+
+    def __init__(self, texts):
+        self.texts = texts
+        self.text = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        text = next(self.texts, None)
+        if text is None:
+            self.eof = True
+            return False
+        self.text = self.text[self.pos:] + text
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Skip whitespace and return the next character, or '' at the end of the input."""
+        while True:
+            self.pos = _WHITESPACE.match(self.text, self.pos).end()
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.fill():
+                return ''
+
+    def decode(self):
+        if not self.peek():
+            raise ValueError("Unexpected end of JSON input")
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.text, self.pos)
+                # A bare number that runs to the end of the buffer, or stops at a '.', 'e' or sign
+                # the decoder could not use yet, may continue in the next chunk
+                if (self.eof or self.text[self.pos] in '{["'
+                        or (end < len(self.text) and self.text[end] not in _NUMBER_CHARACTERS)):
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.fill()
+
+
+def _iter_array(buffer):
+    buffer.pos += 1  # skip '['
+    if buffer.peek() == ']':
+        return
+    while True:
+        yield buffer.decode()
+        separator = buffer.peek()
+        if separator == ']':
+            return
+        if separator != ',':
+            raise ValueError(f"Expected ',' or ']' in JSON array, found {separator!r}")
+        buffer.pos += 1
+
+
+def _iter_lines(buffer):
+    # JSON Lines is a sequence of values separated by newlines, which is just whitespace to the decoder
+    while buffer.peek():
+        yield buffer.decode()
+
+
+def detect_format(file_path, input_format='auto'):
+    """'array' or 'jsonl', picked from the first non-whitespace character with input_format='auto'."""
+    if input_format != 'auto':
+        return input_format
+    return 'array' if _TextBuffer(iter_text(iter_chunks(file_path))).peek() == '[' else 'jsonl'
+
+
+def line_ranges(file_path, count):
+    """Split a local JSON Lines file into count byte ranges of about the same size.
+
+    Every range starts at the beginning of a line, so each line falls in exactly one range.
+    """
+    size = os.path.getsize(file_path)
+    bounds = [0]
+    with open(file_path, 'rb') as file:
+        for shard in range(1, count):
+            position = size * shard // count
+            if position > bounds[-1]:
+                # Step back one byte so a line that starts exactly at position stays in this range
+                file.seek(position - 1)
+                file.readline()
+                position = file.tell()
+            bounds.append(max(position, bounds[-1]))
+    bounds.append(size)
+    return list(zip(bounds, bounds[1:]))
+
+
+def iter_json_items(file_path, input_format='auto', byte_range=None):
+    """Stream items from a JSON array or a JSON Lines document, one item at a time.
+
+    With input_format='auto' the format is picked from the first non-whitespace character.
+    byte_range reads only part of a local JSON Lines file, as split by line_ranges.
+    """
+    buffer = _TextBuffer(iter_text(iter_chunks(file_path, byte_range=byte_range)))
+    first = buffer.peek()
+    if byte_range is not None:
+        if input_format == 'array' or (byte_range[0] == 0 and first == '['):
+            raise ValueError(f"Only JSON Lines input can be read by byte range, not the JSON array in {file_path}")
+        input_format = 'jsonl'
+    if input_format == 'auto':
+        input_format = 'array' if first == '[' else 'jsonl'
+    if input_format == 'array':
+        if first != '[':
+            raise ValueError(f"Expected a JSON array in {file_path}")
+        return _iter_array(buffer)
+    return _iter_lines(buffer)
@@ -0,0 +1,326 @@
+import asyncio
+import itertools
+import time
+
+import numpy as np
+
+from checkpoint import content_hash
+
+# Marks the end of a queue; one is enqueued per consuming worker
+_DONE = object()
+
+# Items pulled from the source per hop off the event loop
+READ_BATCH_SIZE = 256
+
+
+def prepare_item(item, text_field_name, vector_field_name=None, re_embed=False):
+    """Rename fields to match the streamlit app. Returns True if the item still needs an embedding."""
+    # Rename vector_field_name to embedding if present
+    if vector_field_name in item:
+        # Rename text_field_name to text so that it matches the streamlit app
+        item['text'] = item.pop(text_field_name)
+        # Re-embed the text if re_embed is True
+        if re_embed:
+            # get rid of previous vector_field_name, not needed anymore
+            item.pop(vector_field_name)
+            return True
+        # Rename vector_field_name to embedding so that it matches the streamlit app
+        item['embedding'] = item.pop(vector_field_name)
+        return False
+    # Generate embedding for text_field_name if present
+    elif text_field_name in item:
+        # Rename text_field_name to text so that it matches the streamlit app
+        item['text'] = item.pop(text_field_name)
+        return True
+    return False
+
+
+class StageStats:
+    """Document counts and throughput for one pipeline stage."""
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.errors = 0
+        self.started = time.perf_counter()
+        self._last_count = 0
+        self._last_time = self.started
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def rate(self):
+        elapsed = self.elapsed()
+        return self.count / elapsed if elapsed > 0 else 0.0
+
+    def interval_rate(self):
+        now = time.perf_counter()
+        elapsed = now - self._last_time
+        rate = (self.count - self._last_count) / elapsed if elapsed > 0 else 0.0
+        self._last_count = self.count
+        self._last_time = now
+        return rate
+
+    def summary(self):
+        errors = f", {self.errors} errors" if self.errors else ""
+        return f"{self.name}: {self.count} docs, {self.rate():.1f} docs/s{errors}"
+
+
+class PendingItem:
+    """An item in flight, with its position in the input and the containers it still has to reach."""
+
+    __slots__ = ('offset', 'item', 'targets', 'content_hash', 'failed')
+
+    def __init__(self, offset, item, targets, content_hash=None):
+        self.offset = offset
+        self.item = item
+        self.targets = targets
+        self.content_hash = content_hash
+        self.failed = False
+
+
+class IngestPipeline:
+    """Reads, embeds and writes items through bounded queues so each stage scales independently.
+
+    The read stage renames fields and routes items that need an embedding to the embed stage,
+    the embed stage groups them into multi-input requests, and the write stage hands up to
+    write_batch_size items at a time to every container's writer concurrently.
+
+    With a checkpoint, items below a container's committed offset are not written to it again,
+    and with a hash store, items whose content is unchanged since they were last written are
+    skipped before they are embedded. With cache_versions, every container written to since the
+    last progress save has its version bumped, so search results cached for it stop being served.
+    With a vector_transform, every embedding is reduced and encoded by it before it is written.
+    """
+
+    def __init__(self, writers, batcher, text_field_name, vector_field_name=None, re_embed=False,
+                 embed_concurrency=4, write_concurrency=10, write_batch_size=1, queue_size=1000,
+                 report_interval=10, checkpoint=None, hash_store=None, cache_versions=None,
+                 vector_transform=None):
+        self.writers = writers
+        self.batcher = batcher
+        self.text_field_name = text_field_name
+        self.vector_field_name = vector_field_name
+        self.re_embed = re_embed
+        self.embed_concurrency = embed_concurrency
+        self.write_concurrency = write_concurrency
+        self.write_batch_size = write_batch_size
+        self.queue_size = queue_size
+        self.report_interval = report_interval
+        self.checkpoint = checkpoint
+        self.hash_store = hash_store
+        self.cache_versions = cache_versions
+        self.vector_transform = vector_transform
+        self.changed_containers = set()
+        self.skipped = 0
+        self.stats = {name: StageStats(name) for name in ('read', 'embed', 'write')}
+
+    async def run(self, items):
+        """Load every item from an iterable, which may be a lazy stream of any length."""
+        self.embed_queue = asyncio.Queue(maxsize=self.queue_size)
+        self.write_queue = asyncio.Queue(maxsize=self.queue_size)
+        self.write_queue_lock = asyncio.Lock()
+        await asyncio.gather(*(writer.initialize() for writer in self.writers.values()))
+        for stats in self.stats.values():
+            stats.started = time.perf_counter()
+
+        reporter = asyncio.create_task(self._report())
+        embedders = [asyncio.create_task(self._embed_worker()) for _ in range(self.embed_concurrency)]
+        writers = [asyncio.create_task(self._write_worker()) for _ in range(self.write_concurrency)]
+
+        async def close_write_queue():
+            # Only the read and embed stages feed the write queue, so it can be closed once both are done
+            await asyncio.gather(*embedders)
+            for _ in writers:
+                await self.write_queue.put(_DONE)
+
+        try:
+            # Any stage failing surfaces here instead of leaving the others blocked on a full queue
+            await asyncio.gather(self._read(items), close_write_queue(), *writers)
+        finally:
+            reporter.cancel()
+            for task in embedders + writers:
+                task.cancel()
+            # Persist whatever was committed, including when the load is interrupted
+            self._save_progress()
+
+        print("Load complete. " + " | ".join(stats.summary() for stats in self.stats.values())
+              + f" | {self.skipped} skipped | {self.batcher.requests} embedding requests")
+        print("Writes: " + " | ".join(writer.summary() for writer in self.writers.values()))
+
+    def summary(self):
+        """Counts, rates and request charges of the load as plain data, for merging across shards."""
+        return {
+            'stages': {name: {'count': stats.count, 'errors': stats.errors, 'seconds': stats.elapsed()}
+                       for name, stats in self.stats.items()},
+            'skipped': self.skipped,
+            'embedding_requests': self.batcher.requests,
+            'containers': {name: {'documents': writer.documents, 'request_charge': writer.request_charge,
+                                  'throttled': writer.throttle.throttled}
+                           for name, writer in self.writers.items()},
+        }
+
+    async def _read(self, items):
+        stats = self.stats['read']
+        resume_offset = self.checkpoint.resume_offset() if self.checkpoint is not None else 0
+        retry_offsets = self.checkpoint.failed_offsets() if self.checkpoint is not None else set()
+        if resume_offset:
+            print(f"Resuming from offset {resume_offset}.")
+        if retry_offsets:
+            print(f"Retrying {len(retry_offsets)} items that failed in an earlier run.")
+        items = iter(items)
+        next_offset = 0
+        while True:
+            # Streaming sources parse and download on demand, so pull them in small batches
+            # on a worker thread rather than blocking the event loop
+            batch = await asyncio.to_thread(list, itertools.islice(items, READ_BATCH_SIZE))
+            if not batch:
+                break
+            for offset, item in enumerate(batch, start=next_offset):
+                if offset < resume_offset and offset not in retry_offsets:
+                    self.skipped += 1
+                    continue
+                stats.count += 1
+                needs_embedding = prepare_item(item, self.text_field_name, self.vector_field_name, self.re_embed)
+                pending = self._pending_item(offset, item, needs_embedding)
+                if not pending.targets:
+                    self.skipped += 1
+                elif needs_embedding:
+                    await self.embed_queue.put(pending)
+                else:
+                    await self._enqueue_write(pending)
+            next_offset += len(batch)
+        for _ in range(self.embed_concurrency):
+            await self.embed_queue.put(_DONE)
+
+    def _pending_item(self, offset, item, needs_embedding):
+        targets = list(self.writers)
+        if self.checkpoint is not None:
+            targets = [name for name in targets if not self.checkpoint.is_committed(name, offset)]
+
+        item_hash = None
+        if self.hash_store is not None and targets:
+            # Hash before embedding so unchanged items never cost an embedding request
+            embedding_version = self.batcher.model if needs_embedding else None
+            if self.vector_transform is not None:
+                # Documents written with a different representation are written again
+                embedding_version = f"{embedding_version}\0{self.vector_transform.describe()}"
+            item_hash = content_hash(item, embedding_version)
+            stored = self.hash_store.get(item.get('id'))
+            unchanged = [name for name in targets if stored.get(name) == item_hash]
+            for name in unchanged:
+                if self.checkpoint is not None:
+                    self.checkpoint.mark_done(name, offset)
+            targets = [name for name in targets if name not in unchanged]
+        return PendingItem(offset, item, targets, item_hash)
+
+    async def _embed_worker(self):
+        stats = self.stats['embed']
+        done = False
+        while not done:
+            pending = await self.embed_queue.get()
+            if pending is _DONE:
+                break
+            # Take whatever else is already waiting, up to one request's worth; the batcher
+            # enforces the token budget by splitting further if needed
+            batch = [pending]
+            while len(batch) < self.batcher.max_items:
+                try:
+                    pending = self.embed_queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    break
+                if pending is _DONE:
+                    done = True
+                    break
+                batch.append(pending)
+
+            embeddings = await self.batcher.embed([pending.item['text'] for pending in batch])
+            for pending, embedding in zip(batch, embeddings):
+                if embedding is None:
+                    # Recorded as failed, so a rerun from the checkpoint retries it
+                    print(f"Skipping document {pending.item.get('id')}: no embedding could be generated.")
+                    stats.errors += 1
+                    self._fail(pending.targets, pending)
+                    continue
+                pending.item['embedding'] = embedding
+                stats.count += 1
+                await self._enqueue_write(pending)
+
+    async def _enqueue_write(self, pending):
+        # asyncio.Queue lets a fresh put() take a freed slot ahead of one already waiting, which can
+        # starve a producer for the whole load and hold back the checkpoint; the lock keeps puts in order
+        embedding = pending.item.get('embedding')
+        if self.vector_transform is not None and embedding is not None:
+            pending.item['embedding'] = self.vector_transform.encode(embedding)
+        elif isinstance(embedding, np.ndarray):
+            # Embedded vectors stay float32 arrays until here; documents are written as JSON
+            pending.item['embedding'] = embedding.tolist()
+        async with self.write_queue_lock:
+            await self.write_queue.put(pending)
+
+    async def _write_worker(self):
+        stats = self.stats['write']
+        done = False
+        while not done:
+            pending = await self.write_queue.get()
+            if pending is _DONE:
+                break
+            batch = [pending]
+            while len(batch) < self.write_batch_size:
+                try:
+                    pending = self.write_queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    break
+                if pending is _DONE:
+                    done = True
+                    break
+                batch.append(pending)
+
+            # Write the batch to all containers at once
+            await asyncio.gather(*(self._write(name, batch) for name in self.writers))
+            for pending in batch:
+                if pending.failed:
+                    stats.errors += 1
+                else:
+                    stats.count += 1
+
+    async def _write(self, container_name, batch):
+        batch = [pending for pending in batch if container_name in pending.targets]
+        if not batch:
+            return
+        results = await self.writers[container_name].write([pending.item for pending in batch])
+        for pending, written in zip(batch, results):
+            if written:
+                self._commit(container_name, pending)
+            else:
+                pending.failed = True
+                self._fail([container_name], pending)
+
+    def _commit(self, container_name, pending):
+        if self.checkpoint is not None:
+            self.checkpoint.mark_done(container_name, pending.offset)
+        if self.hash_store is not None:
+            self.hash_store.put(container_name, pending.item.get('id'), pending.content_hash)
+        self.changed_containers.add(container_name)
+
+    def _fail(self, container_names, pending):
+        if self.checkpoint is not None:
+            for container_name in container_names:
+                self.checkpoint.mark_failed(container_name, pending.offset)
+
+    def _save_progress(self):
+        if self.hash_store is not None:
+            self.hash_store.flush()
+        if self.checkpoint is not None:
+            self.checkpoint.save()
+        if self.cache_versions is not None and self.changed_containers:
+            self.cache_versions.bump(self.changed_containers)
+            self.changed_containers = set()
+
+    async def _report(self):
+        while True:
+            await asyncio.sleep(self.report_interval)
+            stages = " | ".join(f"{stats.name} {stats.count} ({stats.interval_rate():.1f}/s)" for stats in self.stats.values())
+            print(f"{stages} | skipped {self.skipped} | queued to embed {self.embed_queue.qsize()}, to write {self.write_queue.qsize()}")
+            print("  " + " | ".join(writer.readout() for writer in self.writers.values()))
+            self._save_progress()
@@ -0,0 +1,168 @@
+import asyncio
+import collections
+import contextlib
+import time
+
+# How often the in-flight limit is re-evaluated, and how far back the live readout looks
+ADJUST_INTERVAL = 1.0
+READOUT_WINDOW = 5.0
+# Weight of the newest observation in the running estimate of RU per document
+CHARGE_SMOOTHING = 0.2
+# Starting estimate, roughly what a small indexed document costs to upsert
+INITIAL_RU_PER_DOCUMENT = 10.0
+# The bucket holds this many seconds of budget; the service meters per second, so a full
+# second of burst on top of the steady rate would overshoot it
+BURST_SECONDS = 0.2
+# Ceiling on requests in flight per container; a paced write stage is sized to reach it
+MAX_CONCURRENCY = 512
+
+
+class _Request:
+    """One governed request; the response hook records what the service actually charged."""
+
+    def __init__(self, reserved):
+        self.reserved = reserved
+        self.charge = 0.0
+
+    def record(self, headers, _):
+        self.charge += float(headers.get('x-ms-request-charge', 0))
+
+
+class RuGovernor:
+    """Paces writes to one container at a target RU/s.
+
+    A token bucket holds a fraction of a second of the RU budget. Each request reserves its expected
+    charge (a running average of RU per document) before it is sent, and the difference to the
+    real x-ms-request-charge is settled when it returns. The number of requests in flight is
+    raised by a tenth while the budget is underused and the limit is the bottleneck, and cut
+    by 30% on throttling. Without a target the governor only caps concurrency and
+    keeps the readout.
+    """
+
+    def __init__(self, target_ru_per_second=None, concurrency=10, min_concurrency=1, max_concurrency=MAX_CONCURRENCY):
+        self.target = target_ru_per_second
+        self.concurrency = concurrency
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.ru_per_document = INITIAL_RU_PER_DOCUMENT
+        self.tokens = 0.0
+        self.started = self.refilled_at = self.adjusted_at = time.monotonic()
+        self.saturated = False
+        self.throttled = False
+        self.completed = collections.deque()
+        self._waiters = collections.deque()
+
+    def set_target(self, target_ru_per_second):
+        self.target = target_ru_per_second
+
+    def _capacity(self):
+        return self.target * BURST_SECONDS
+
+    @contextlib.asynccontextmanager
+    async def request(self, documents=1):
+        """Hold a slot and RU reservation for one request; pass the yielded request's record as response_hook."""
+        request = await self._acquire(documents)
+        throttled = False
+        try:
+            yield request
+        except Exception as e:
+            throttled = getattr(e, 'status_code', None) == 429
+            raise
+        finally:
+            self._release(request, documents, throttled)
+
+    async def _acquire(self, documents):
+        await self._acquire_slot()
+        reserved = 0.0
+        try:
+            if self.target:
+                reserved = self.ru_per_document * documents
+                while True:
+                    self._refill()
+                    # A request costing more than the whole bucket is let through once the bucket is full
+                    needed = min(reserved, self._capacity())
+                    if self.tokens >= needed:
+                        self.tokens -= reserved
+                        break
+                    await asyncio.sleep((needed - self.tokens) / self.target)
+        except BaseException:
+            self.in_flight -= 1
+            self._wake()
+            raise
+        return _Request(reserved)
+
+    async def _acquire_slot(self):
+        if self.in_flight < self.concurrency and not self._waiters:
+            self.in_flight += 1
+            return
+        # Slots are handed to waiters in arrival order so no writer is starved
+        self.saturated = True
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.in_flight -= 1
+                self._wake()
+            raise
+
+    def _wake(self):
+        while self._waiters and self.in_flight < self.concurrency:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def _release(self, request, documents, throttled):
+        self.in_flight -= 1
+        now = time.monotonic()
+        if throttled:
+            self.throttled = True
+            # The service is already over budget; stop spending until the bucket refills
+            self.tokens = min(self.tokens, 0.0)
+        else:
+            if self.target:
+                self.tokens += request.reserved - request.charge
+            if documents and request.charge:
+                observed = request.charge / documents
+                self.ru_per_document += CHARGE_SMOOTHING * (observed - self.ru_per_document)
+            self.completed.append((now, request.charge, documents))
+        if now - self.adjusted_at >= ADJUST_INTERVAL:
+            self._adjust(now)
+        self._wake()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self._capacity(), self.tokens + (now - self.refilled_at) * self.target)
+        self.refilled_at = now
+
+    def _adjust(self, now):
+        ru_rate, _ = self.rates(now)
+        if self.throttled:
+            self.concurrency = max(self.min_concurrency, int(self.concurrency * 0.7))
+        elif self.target and self.saturated and ru_rate < 0.9 * self.target:
+            self.concurrency = min(self.max_concurrency, self.concurrency + max(1, self.concurrency // 10))
+        elif self.target and ru_rate > 1.05 * self.target:
+            self.concurrency = max(self.min_concurrency, self.concurrency - 1)
+        self.throttled = False
+        self.saturated = False
+        self.adjusted_at = now
+
+    def rates(self, now=None):
+        """RU/s and documents/s over the readout window."""
+        now = now if now is not None else time.monotonic()
+        while self.completed and now - self.completed[0][0] > READOUT_WINDOW:
+            self.completed.popleft()
+        span = min(READOUT_WINDOW, now - self.started)
+        if span <= 0:
+            return 0.0, 0.0
+        ru = sum(charge for _, charge, _ in self.completed)
+        documents = sum(count for _, _, count in self.completed)
+        return ru / span, documents / span
+
+    def readout(self):
+        ru_rate, document_rate = self.rates()
+        target = f"/{self.target:.0f}" if self.target else ""
+        return f"{ru_rate:.0f}{target} RU/s, {document_rate:.0f} docs/s, {self.in_flight}/{self.concurrency} in flight"
@@ -0,0 +1,175 @@
+import asyncio
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+
+from json_stream import detect_format, is_url, line_ranges
+
+# Splits a load across loader processes, so JSON parsing, field renaming and request
+# serialization use several cores instead of one. The parent process starts one worker per
+# shard by re-running the loader with the same arguments plus --shard. Each worker has its own
+# clients, its own share of the RU budget and its own checkpoint. When the workers finish, the
+# parent prints their stats and the merged totals.
+#
+# Shards are either:
+#   bytes  line-aligned byte ranges of a local JSON Lines file; each worker reads only its range
+#   id     the items whose id hashes to the shard; each worker parses the whole input and skips
+#          the rest, so parsing is not split, but embedding, renaming and writing are
+
+SHARD_MODES = ('auto', 'bytes', 'id')
+
+# Lines from workers can hold a whole document when a write fails
+_WORKER_LINE_LIMIT = 1 << 20
+
+
+def shard_of(item_id, shard_count):
+    """The shard an id belongs to; stable across processes and runs, unlike hash()."""
+    digest = hashlib.sha256(str(item_id).encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % shard_count
+
+
+class Shard:
+    """One worker's part of the input: a byte range of the file, or the ids that hash to it."""
+
+    def __init__(self, index, count, byte_range=None):
+        self.index = index
+        self.count = count
+        self.byte_range = byte_range
+
+    @property
+    def label(self):
+        return f"shard {self.index + 1}/{self.count}"
+
+    def describe(self):
+        if self.byte_range is not None:
+            return f"{self.label}, bytes {self.byte_range[0]}-{self.byte_range[1]}"
+        return f"{self.label}, by id"
+
+    def arguments(self):
+        """The loader arguments that make a worker load this shard."""
+        arguments = ['--shard', f"{self.index}/{self.count}"]
+        if self.byte_range is not None:
+            arguments += ['--shard_range', f"{self.byte_range[0]}:{self.byte_range[1]}"]
+        return arguments
+
+    def filter(self, items):
+        if self.byte_range is not None:
+            return items
+        return (item for item in items if shard_of(item.get('id'), self.count) == self.index)
+
+    def checkpoint_path(self, path):
+        return f"{path}.shard-{self.index + 1}-of-{self.count}"
+
+
+def parse_shard(shard, shard_range=None):
+    index, count = (int(value) for value in shard.split('/'))
+    byte_range = tuple(int(value) for value in shard_range.split(':')) if shard_range else None
+    return Shard(index, count, byte_range)
+
+
+def plan_shards(file_path, input_format, workers, shard_by='auto'):
+    """Shards for workers processes: byte ranges for a local JSON Lines file, otherwise id hashes."""
+    splittable = not is_url(file_path) and detect_format(file_path, input_format) == 'jsonl'
+    if shard_by == 'bytes' and not splittable:
+        raise ValueError("--shard_by bytes needs a local JSON Lines file; use --shard_by id for URLs and JSON arrays")
+    if shard_by == 'id' or not splittable:
+        return [Shard(index, workers) for index in range(workers)]
+    return [Shard(index, workers, byte_range) for index, byte_range in enumerate(line_ranges(file_path, workers))]
+
+
+def write_shard_stats(path, shard, summary):
+    with open(path, 'w') as file:
+        json.dump(dict(summary, shard=shard.describe()), file)
+
+
+async def _relay(shard, process):
+    # Prefix worker output with its shard, a line at a time so lines from different workers never mix
+    while line := await process.stdout.readline():
+        print(f"[{shard.label}] {line.decode('utf-8', errors='replace').rstrip()}")
+    return await process.wait()
+
+
+async def run_workers(script, arguments, shards):
+    """Run the loader script once per shard and print per-shard and merged stats.
+
+    Returns the worker exit codes, in shard order.
+    """
+    # Workers print as they go rather than when their buffers fill
+    env = dict(os.environ, PYTHONUNBUFFERED='1')
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory(prefix='loader-shards-') as stats_dir:
+        stats_paths = [os.path.join(stats_dir, f"shard-{shard.index}.json") for shard in shards]
+        processes = []
+        for shard, stats_path in zip(shards, stats_paths):
+            print(f"Starting {shard.describe()}")
+            processes.append(await asyncio.create_subprocess_exec(
+                sys.executable, script, *arguments, *shard.arguments(), '--shard_stats', stats_path,
+                stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT, env=env, limit=_WORKER_LINE_LIMIT))
+        try:
+            codes = await asyncio.gather(*(_relay(shard, process) for shard, process in zip(shards, processes)))
+        finally:
+            for process in processes:
+                if process.returncode is None:
+                    process.terminate()
+        elapsed = time.perf_counter() - start
+        summaries = []
+        for stats_path in stats_paths:
+            if os.path.exists(stats_path):
+                with open(stats_path, 'r') as file:
+                    summaries.append(json.load(file))
+            else:
+                summaries.append(None)
+    print_shard_summary(shards, summaries, codes, elapsed)
+    return codes
+
+
+def merge_summaries(summaries):
+    """Totals across shard summaries; seconds is the longest shard's."""
+    merged = {'stages': {}, 'skipped': 0, 'embedding_requests': 0, 'containers': {}}
+    for summary in summaries:
+        for name, stage in summary['stages'].items():
+            total = merged['stages'].setdefault(name, {'count': 0, 'errors': 0, 'seconds': 0.0})
+            total['count'] += stage['count']
+            total['errors'] += stage['errors']
+            total['seconds'] = max(total['seconds'], stage['seconds'])
+        merged['skipped'] += summary['skipped']
+        merged['embedding_requests'] += summary['embedding_requests']
+        for name, container in summary['containers'].items():
+            total = merged['containers'].setdefault(name, {'documents': 0, 'request_charge': 0.0, 'throttled': 0})
+            for key, value in container.items():
+                total[key] += value
+    return merged
+
+
+def _row(label, summary, seconds):
+    written = summary['stages']['write']['count']
+    errors = sum(stage['errors'] for stage in summary['stages'].values())
+    request_charge = sum(container['request_charge'] for container in summary['containers'].values())
+    throttled = sum(container['throttled'] for container in summary['containers'].values())
+    rate = written / seconds if seconds > 0 else 0.0
+    return (f"{label:<14}{summary['stages']['read']['count']:>9}{written:>9}{summary['skipped']:>9}"
+            f"{rate:>9.1f}{request_charge:>12.0f}{errors:>8}{throttled:>11}")
+
+
+def print_shard_summary(shards, summaries, codes, elapsed):
+    print(f"{'shard':<14}{'read':>9}{'written':>9}{'skipped':>9}{'docs/s':>9}{'RU':>12}{'errors':>8}{'throttled':>11}")
+    for shard, summary, code in zip(shards, summaries, codes):
+        if summary is None:
+            print(f"{shard.label:<14}  exited with code {code} before reporting")
+            continue
+        print(_row(shard.label, summary, summary['stages']['write']['seconds']))
+    finished = [summary for summary in summaries if summary is not None]
+    if not finished:
+        return
+    # Combined throughput is over wall-clock time, including worker start-up
+    merged = merge_summaries(finished)
+    print(_row("all", merged, elapsed))
+    print("Writes: " + " | ".join(
+        f"{name}: {container['request_charge']:.0f} RU "
+        f"({container['request_charge'] / container['documents'] if container['documents'] else 0.0:.2f} RU/doc), "
+        f"{container['throttled']} throttled"
+        for name, container in merged['containers'].items()))
+    print(f"{merged['embedding_requests']} embedding requests in {elapsed:.1f} seconds across {len(shards)} workers")
@@ -0,0 +1,164 @@
+import argparse
+import itertools
+import json
+import os
+import sys
+
+import numpy as np
+from dotenv import load_dotenv
+
+# Modules shared with the app live in src/common
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from common.clients import create_openai_client, embedding_model
+from common.embedding_cache import cache_from_env
+from common.embedding_decode import ENCODING_FORMAT, decode_embeddings
+from common.local_backend import WRITE_BASE_CHARGE, WRITE_CHARGE_PER_KB
+from common.vector_transform import VectorTransform, fit_pca
+from embedding_batcher import DEFAULT_MAX_BATCH_ITEMS, iter_batches
+from json_stream import iter_json_items
+from pipeline import prepare_item
+
+# Chooses a compact representation for the stored embeddings. On a sample of the input it
+# compares candidate transforms (reduced dimensions by truncation or PCA, and float32, float16 or
+# int8 encoding) by vector and document size, write RU per document and recall@k against the
+# full float32 vectors. It then saves the chosen transform for the loader (--vector_transform)
+# and the app (VECTOR_TRANSFORM_PATH).
+#
+# how to call:
+# python src/data/vector_compaction.py --path_to_json_array "movies.json" --text_field_name "overview" --vector_field_name "vector"
+# python src/data/vector_compaction.py --path_to_json_array "movies.json" --text_field_name "overview" --method pca --dimensions 256 --encoding int8 --output vector-transform.npz
+
+DEFAULT_CANDIDATES = ("none:0:float32,none:0:float16,none:0:int8,truncate:512:float32,truncate:256:int8,"
+                      "pca:256:float32,pca:256:int8,pca:128:int8")
+
+
+def load_sample(args):
+    """The first --sample documents, prepared as the loader would, and a float32 vector for each."""
+    items = list(itertools.islice(iter_json_items(args.path_to_json_array, args.input_format), args.sample))
+    documents, texts = [], []
+    for item in items:
+        needs_embedding = prepare_item(item, args.text_field_name, args.vector_field_name, args.re_embed)
+        if needs_embedding or 'embedding' in item:
+            documents.append(item)
+            texts.append(item.get('text') if needs_embedding else None)
+    missing = [position for position, text in enumerate(texts) if text is not None]
+    if missing:
+        print(f"Embedding {len(missing)} sample texts with {embedding_model()}")
+        embed_texts(documents, missing, [texts[position] for position in missing])
+    vectors = np.asarray([document.pop('embedding') for document in documents], dtype=np.float32)
+    return documents, vectors
+
+
+def embed_texts(documents, positions, texts):
+    client = create_openai_client()
+    cache = cache_from_env()
+    model = embedding_model()
+    for batch in iter_batches(zip(positions, texts), max_items=DEFAULT_MAX_BATCH_ITEMS):
+        cached = cache.get_many(model, [text for _, text in batch])
+        uncached = [(position, text) for (position, text), vector in zip(batch, cached) if vector is None]
+        if uncached:
+            response = client.embeddings.create(input=[text for _, text in uncached], model=model, encoding_format=ENCODING_FORMAT)
+            cache.put_many(model, [text for _, text in uncached], decode_embeddings(response))
+            cached = cache.get_many(model, [text for _, text in batch])
+        for (position, _), vector in zip(batch, cached):
+            documents[position]['embedding'] = vector
+    cache.close()
+
+
+def build_transform(method, dimensions, encoding, sample):
+    if method == "pca":
+        return fit_pca(sample, dimensions, encoding)
+    return VectorTransform(method, dimensions if method == "truncate" else None, encoding)
+
+
+def parse_candidate(text):
+    method, dimensions, encoding = text.strip().split(":")
+    return method, int(dimensions), encoding
+
+
+def exact_top_k(queries, vectors, k):
+    norms = np.linalg.norm(vectors, axis=1)
+    norms[norms == 0] = 1.0
+    scores = queries @ (vectors / norms[:, None]).T
+    return np.argsort(-scores, axis=1, kind="stable")[:, :k]
+
+
+def evaluate(transform, documents, vectors, queries, top_k, baseline):
+    """Sizes, estimated write charge and recall@k for documents stored with the transform."""
+    encoded = [transform.encode(vector) for vector in vectors]
+    vector_bytes = np.mean([len(json.dumps(vector)) for vector in encoded])
+    document_bytes = np.mean([len(json.dumps(dict(document, embedding=vector))) for document, vector in zip(documents, encoded)])
+    stored = np.asarray(encoded, dtype=np.float32)
+    encoded_queries = np.asarray([transform.encode(query) for query in queries], dtype=np.float32)
+    encoded_queries /= np.maximum(np.linalg.norm(encoded_queries, axis=1, keepdims=True), 1e-12)
+    found = exact_top_k(encoded_queries, stored, top_k)
+    recall = np.mean([len(set(row) & set(expected)) / len(expected) for row, expected in zip(found, baseline)])
+    return {
+        "representation": transform.describe(),
+        "dimensions": stored.shape[1],
+        "data_type": transform.data_type,
+        "vector_bytes": vector_bytes,
+        "document_bytes": document_bytes,
+        "write_ru": WRITE_BASE_CHARGE + WRITE_CHARGE_PER_KB * document_bytes / 1024,
+        f"recall@{top_k}": recall,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare compact vector representations on a sample and save one for the loader and the app.")
+    parser.add_argument("--path_to_json_array", required=True, help="The path or URL of the JSON array or JSON Lines file the loader reads.")
+    parser.add_argument("--input_format", choices=['auto', 'array', 'jsonl'], default='auto', help="Format of the input.")
+    parser.add_argument("--text_field_name", required=True, help="The name of the field containing the text.")
+    parser.add_argument("--vector_field_name", help="The name of the field containing pre-generated embeddings; otherwise the sample is embedded.")
+    parser.add_argument("--re_embed", type=bool, default=False, help="Embed the sample even when it has a vector field.")
+    parser.add_argument("--sample", type=int, default=2000, help="Documents read from the start of the input.")
+    parser.add_argument("--num_queries", type=int, default=200, help="Sample vectors held out as queries for recall.")
+    parser.add_argument("--top_k", type=int, default=10, help="The k in recall@k.")
+    parser.add_argument("--candidates", default=DEFAULT_CANDIDATES, help="Comma-separated method:dimensions:encoding to compare; method is none, truncate or pca.")
+    parser.add_argument("--method", choices=["none", "truncate", "pca"], help="With --output, the reduction to save.")
+    parser.add_argument("--dimensions", type=int, help="With --output, the dimensions to reduce to.")
+    parser.add_argument("--encoding", choices=["float32", "float16", "int8"], default="float32", help="With --output, the encoding to save.")
+    parser.add_argument("--output", help="Save the transform given by --method, --dimensions and --encoding, fitted on the whole sample, to this .npz file.")
+    parser.add_argument("--output_json", help="Write the comparison to this JSON file.")
+    args = parser.parse_args()
+
+    load_dotenv()
+    documents, vectors = load_sample(args)
+    if len(vectors) <= args.num_queries:
+        parser.error(f"The sample has {len(vectors)} vectors; it needs more than --num_queries")
+    print(f"Sample of {len(vectors)} vectors with {vectors.shape[1]} dimensions")
+
+    # Queries are held out of the sample that PCA is fitted on
+    documents, queries = documents[:-args.num_queries], vectors[-args.num_queries:]
+    vectors = vectors[:-args.num_queries]
+    unit_queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+    baseline = exact_top_k(unit_queries, vectors, args.top_k)
+
+    rows = []
+    for method, dimensions, encoding in map(parse_candidate, args.candidates.split(",")):
+        if dimensions > vectors.shape[1] or (method == "pca" and dimensions > len(vectors)):
+            print(f"Skipping {method}:{dimensions}:{encoding}, which needs more dimensions or sample vectors")
+            continue
+        rows.append(evaluate(build_transform(method, dimensions, encoding, vectors), documents, vectors, queries, args.top_k, baseline))
+
+    print(f"{'representation':<28}{'dims':>6}{'type':>9}{'vector B':>10}{'doc B':>9}{'write RU':>10}{f'recall@{args.top_k}':>11}")
+    for row in rows:
+        print(f"{row['representation']:<28}{row['dimensions']:>6}{row['data_type']:>9}{row['vector_bytes']:>10.0f}"
+              f"{row['document_bytes']:>9.0f}{row['write_ru']:>10.2f}{row[f'recall@{args.top_k}']:>11.3f}")
+    print("Write RU is estimated from document size with the local backend's charge model; compare rows, not absolute values.")
+    if args.output_json:
+        with open(args.output_json, "w", encoding="utf-8") as file:
+            json.dump({"sample": len(vectors) + len(queries), "top_k": args.top_k, "results": rows}, file, indent=2)
+
+    if args.output:
+        if not args.method:
+            parser.error("--output needs --method")
+        transform = build_transform(args.method, args.dimensions, args.encoding, np.concatenate([vectors, queries]))
+        transform.save(args.output)
+        print(f"Saved {transform.describe()} to {args.output}. Containers for it need {transform.output_dimensions(vectors.shape[1])} "
+              f"dimensions of {transform.data_type}; run the loader with --vector_transform {args.output} and the app with VECTOR_TRANSFORM_PATH={args.output}.")
+
+
+if __name__ == "__main__":
+    main()